@@ -24,7 +24,7 @@ location = pvlib.location.Location(latitude=-41.13941227780086,
 ghi = sdg.SyntheticIrradiance(times, location)  # Initialized with a clearsky model
 
 # Visualize synthetic irradiance data:
-clearsky_ghi = ghi.series
+clearsky_ghi = ghi.series.copy()
 
 print("Visualizing synthetic clearsky irradiance")
 plt.figure(1)
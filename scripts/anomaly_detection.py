@@ -1,105 +1,494 @@
+import threading
 import numpy as np
 import pandas as pd
 import pvlib
 
 if __name__ == "__main__":
     from utils import validate_pvlib_location, validate_timezone_aware
+    from linear_fit import rolling_linear_residual_std, backfill_window
+    from rolling_median import rolling_median_mad
+    from profiling import profiled, stage
 else:
     from . utils import validate_pvlib_location, validate_timezone_aware
+    from . linear_fit import rolling_linear_residual_std, backfill_window
+    from . rolling_median import rolling_median_mad
+    from . profiling import profiled, stage
 
 
+NS_PER_DAY = 86_400 * 10**9
+
+
+def get_sunrise_sunset_table(times: pd.DatetimeIndex,
+                             location: pvlib.location.Location):
+    """
+    Computes sunrise and sunset once per day covered by times.
+
+    pvlib's sun_rise_set_transit_spa() evaluates the day (UTC midnight) that
+    contains each timestamp, so every timestamp of a day gets the same pair.
+    Here SPA runs only for the distinct days.
+
+    Args:
+        times: timezone aware pandas.DatetimeIndex.
+        location: pvlib.location.Location
+
+    Returns:
+        days: sorted int64 array of day numbers (UTC days since epoch).
+        table: pandas.DataFrame with 'sunrise' and 'sunset' for each day,
+            in the timezone of times.
+    """
+    # Check input validity:
+    validate_pvlib_location(location)
+    validate_timezone_aware(times)
+
+    days, _ = _index_days(times)
+    return days, _sunrise_sunset_for_days(days, times.tz, location)
+
+
+@profiled("get_night_mask")
 def get_night_mask(times: pd.DatetimeIndex,
-                   location: pvlib.location.Location) -> np.ndarray:
+                   location: pvlib.location.Location,
+                   cache=None) -> np.ndarray:
     """ Takes time and location and returns a mask for night timestamps.
         timeseries: pandas.Series (must be timezone aware)
         Location: pvlib.location.Location
+        cache: optional solar_cache.SolarCache to reuse a stored mask
     """
+    if cache is not None:
+        return cache.get_array("night_mask", location, times,
+                               lambda: _compute_night_mask(times, location))
+    return _compute_night_mask(times, location)
+
+
+def _compute_night_mask(times, location):
+    # Uncached, unprofiled body of get_night_mask.
+
     # Check input validity:
     validate_pvlib_location(location)
     validate_timezone_aware(times)
 
-    df = pvlib.solarposition.sun_rise_set_transit_spa(times,
-                                                      location.latitude,
-                                                      location.longitude,
-                                                      how="numpy")
-    return (times < df["sunrise"]) | (times > df["sunset"])
+    days, day_index = _index_days(times)
+    table = _sunrise_sunset_for_days(days, times.tz, location)
+
+    # Broadcast each day's sunrise/sunset back onto the timestamps:
+    sunrise = pd.DatetimeIndex(table["sunrise"]).as_unit("ns")
+    sunset = pd.DatetimeIndex(table["sunset"]).as_unit("ns")
+    has_sunrise = ~sunrise.isna()[day_index]
+    has_sunset = ~sunset.isna()[day_index]
+
+    # Days without sunrise or sunset (NaT) are never flagged, as before:
+    ns = times.as_unit("ns").asi8
+    before_sunrise = has_sunrise & (ns < sunrise.asi8[day_index])
+    after_sunset = has_sunset & (ns > sunset.asi8[day_index])
+    return before_sunrise | after_sunset
+
+
+def _index_days(times: pd.DatetimeIndex):
+    # Distinct UTC days of times, and the position of each timestamp's day.
+    day_numbers = times.as_unit("ns").asi8 // NS_PER_DAY
+    if times.is_monotonic_increasing:
+        # Sorted input: days change only at a few boundaries, no sort needed.
+        is_new_day = np.empty(len(day_numbers), dtype=bool)
+        is_new_day[:1] = True
+        np.not_equal(day_numbers[1:], day_numbers[:-1], out=is_new_day[1:])
+        return day_numbers[is_new_day], np.cumsum(is_new_day) - 1
+    return np.unique(day_numbers, return_inverse=True)
+
+
+def _sunrise_sunset_for_days(days, tz, location):
+    # One SPA evaluation per day, at the UTC midnight pvlib normalizes to.
+    day_starts = pd.DatetimeIndex(days * NS_PER_DAY, tz="UTC").tz_convert(tz)
+    with stage("sunrise_sunset", len(days)):
+        table = pvlib.solarposition.sun_rise_set_transit_spa(
+            day_starts, location.latitude, location.longitude, how="numpy")
+    return table[["sunrise", "sunset"]]
+
+
+def get_clearsky_interpolated(location: pvlib.location.Location,
+                              times: pd.DatetimeIndex,
+                              model: str = "ineichen",
+                              step: str = "15min"):
+    """
+    Evaluates the clearsky model on a coarse grid and interpolates it
+    linearly onto times.
+
+    The grid has one point every step plus the sunrise and sunset instants,
+    so the kinks where the clearsky curve leaves zero are kept. The error is
+    estimated by evaluating the model at the midpoint of every grid interval,
+    where linear interpolation of a smooth curve deviates the most.
+
+    Args:
+        location: pvlib.location.Location of the site.
+        times: timezone aware pandas.DatetimeIndex.
+        model: Model name passed to Location.get_clearsky().
+        step: Spacing of the coarse grid, e.g. "5min" or "15min".
+
+    Returns:
+        components: pandas.DataFrame of ghi, dni, dhi indexed by times.
+        max_error: pandas.Series with the estimated maximum absolute
+            interpolation error of each component [W/m^2].
+    """
+    # Check input validity:
+    validate_pvlib_location(location)
+    validate_timezone_aware(times)
+    if len(times) == 0:
+        components = location.get_clearsky(times, model=model)
+        return components, pd.Series(0.0, index=components.columns)
+
+    # Coarse grid covering times, plus the sunrise/sunset instants within:
+    step_ns = pd.Timedelta(step).value
+    ns = times.as_unit("ns").asi8
+    first = ns.min() // step_ns * step_ns
+    last = -(-ns.max() // step_ns) * step_ns
+    grid = np.arange(first, last + step_ns, step_ns)
+
+    days, _ = _index_days(pd.DatetimeIndex(grid, tz="UTC"))
+    table = _sunrise_sunset_for_days(days, "UTC", location)
+    events = pd.DatetimeIndex(table.stack()).as_unit("ns").asi8
+    events = events[(events > first) & (events < last)]
+    knots = np.union1d(grid, events)
+
+    def evaluate(knots_ns):
+        knot_times = pd.DatetimeIndex(knots_ns, tz="UTC").tz_convert(times.tz)
+        return location.get_clearsky(knot_times, model=model)
+
+    def interpolate(values, target_ns):
+        x = (target_ns - knots[0]).astype(float)
+        xp = (knots - knots[0]).astype(float)
+        return np.column_stack([np.interp(x, xp, values[:, k])
+                                for k in range(values.shape[1])])
+
+    coarse = evaluate(knots)
+    values = coarse.to_numpy(dtype=float)
+    components = pd.DataFrame(interpolate(values, ns),
+                              index=times,
+                              columns=coarse.columns)
+
+    # Error estimate at the midpoints of the grid intervals:
+    midpoints = knots[:-1] + np.diff(knots) // 2
+    exact = evaluate(midpoints).to_numpy(dtype=float)
+    error = np.abs(interpolate(values, midpoints) - exact)
+    max_error = pd.Series(error.max(axis=0, initial=0.0), index=coarse.columns)
+    return components, max_error
+
+
+class DetectionContext:
+    """
+    Features of a timestamp index and location that don't depend on the
+    detector parameters: night mask and clearsky components.
+
+    Build it once per series and pass it to the detectors through their
+    context argument, so the solar geometry is computed only once for any
+    number of detector runs. Features are computed lazily on first use.
+
+    Args:
+        times: timezone aware pandas.DatetimeIndex of the series.
+        location: pvlib.location.Location of the site.
+        clearsky_model: Model name passed to Location.get_clearsky().
+        clearsky_step: Optional coarse grid spacing (e.g. "15min") to
+            interpolate the clearsky model instead of evaluating it at every
+            timestamp. The estimated error is kept in clearsky_error.
+        cache: Optional solar_cache.SolarCache, to load the features from
+            disk when this site and period were seen before.
+    """
+
+    def __init__(self,
+                 times: pd.DatetimeIndex,
+                 location: pvlib.location.Location,
+                 clearsky_model: str = "ineichen",
+                 clearsky_step: str = None,
+                 cache=None):
+        # Check input validity:
+        validate_pvlib_location(location)
+        validate_timezone_aware(times)
+
+        self.times = times
+        self.location = location
+        self.clearsky_model = clearsky_model
+        self.clearsky_step = clearsky_step
+        self.cache = cache
+
+        self._night_mask = None
+        self._clearsky = None
+        self.clearsky_error = None  # Set when clearsky is interpolated
+        # Features may be requested from several threads (e.g. GUI workers):
+        self._lock = threading.RLock()
+
+    @property
+    def night_mask(self) -> np.ndarray:
+        with self._lock:
+            if self._night_mask is None:
+                self._night_mask = get_night_mask(self.times,
+                                                  self.location,
+                                                  self.cache)
+        return self._night_mask
+
+    @property
+    def is_daytime(self) -> np.ndarray:
+        return ~self.night_mask
+
+    @property
+    def clearsky(self) -> pd.DataFrame:
+        # pvlib's get_clearsky returns a dataframe of ghi, dni, dhi
+        with self._lock:
+            if self._clearsky is None:
+                with stage("clearsky", len(self.times)):
+                    self._clearsky = self._compute_clearsky()
+        return self._clearsky
+
+    def _compute_clearsky(self):
+        if self.clearsky_step is not None:
+            interpolate = (get_clearsky_interpolated if self.cache is None
+                           else self.cache.get_clearsky_interpolated)
+            clearsky, self.clearsky_error = interpolate(self.location,
+                                                        self.times,
+                                                        self.clearsky_model,
+                                                        self.clearsky_step)
+            return clearsky
+        if self.cache is not None:
+            return self.cache.get_clearsky(self.location, self.times,
+                                           model=self.clearsky_model)
+        return self.location.get_clearsky(self.times,
+                                          model=self.clearsky_model)
+
+    def check_series(self, timeseries: pd.Series,
+                     location: pvlib.location.Location = None):
+        """
+        Raises:
+            ValueError: if timeseries isn't indexed by the context's times,
+                or location isn't the context's site.
+        """
+        index = timeseries.index
+        if index is not self.times and not index.equals(self.times):
+            raise ValueError("DetectionContext was built for a different "
+                             "index than the timeseries.")
+        if location is not None and location is not self.location:
+            site = (location.latitude, location.longitude,
+                    str(location.tz), location.altitude)
+            if site != (self.location.latitude, self.location.longitude,
+                        str(self.location.tz), self.location.altitude):
+                raise ValueError("DetectionContext was built for a different "
+                                 "location.")
+
+
+def _column_axis(timeseries):
+    # Broadcasts per-timestamp features against the values: as is for a
+    # Series, as a column for a DataFrame with one column per sensor.
+    return np.s_[:, np.newaxis] if timeseries.ndim == 2 else np.s_[:]
+
+
+def _wrap_mask(mask, timeseries):
+    # Mask array as a Series, or a DataFrame with the sensors' columns.
+    if timeseries.ndim == 2:
+        return pd.DataFrame(mask, index=timeseries.index,
+                            columns=timeseries.columns)
+    return pd.Series(mask, index=timeseries.index, name=timeseries.name)
+
+
+def _get_context(timeseries, location, context):
+    # Build a throwaway context when the caller didn't provide one.
+    if context is None:
+        return DetectionContext(timeseries.index, location)
+    context.check_series(timeseries, location)
+    return context
 
 
 def anomaly_ceiling(timeseries: pd.Series, max_value: float):
     # Simply returns a mask
     return timeseries > max_value
 
+@profiled("anomaly_clearsky")
 def anomaly_clearsky(timeseries: pd.Series,
                      location: pvlib.location.Location,
                      irradiance_type: str,
                      day_margin: float = 1.25,
-                     night_threshold: float = 10):
+                     night_threshold: float = 10,
+                     context: DetectionContext = None):
     """
     Identifies outliers in a timeseries of irradiance data by comparing it to 
     a clearsky model.
 
     Args:
-        timeseries: The irradiance timeseries to check.
+        timeseries: The irradiance timeseries to check, or a DataFrame of
+            co-located sensors (one column each) sharing the same index.
+            The night mask and clearsky are computed once for all columns.
         location: The pvlib Location object representing the site.
         irradiance_type: The type of irradiance (e.g., 'ghi', 'dni', 'dhi').
         day_margin: The margin by which the timeseries can deviate from the 
             clearsky model before being considered an anomaly.
         night_threshold: A threshold value for nighttime irradiance.
+        context: Optional DetectionContext for timeseries.index and location,
+            to reuse its night mask and clearsky components.
 
     Returns:
-        mask: A pandas Series with boolean values indicating anomalies.
+        mask: A pandas Series with boolean values indicating anomalies
+            (a DataFrame with the same columns for a DataFrame input).
         general_threshold: A pandas Series to plot the boundary of the algorithm
     """
-    is_night = get_night_mask(timeseries.index, location)
-
-    # pvlib's get_clearsky returns a dataframe of ghi, dni, dhi
-    components = location.get_clearsky(timeseries.index, model="ineichen")
-    clearsky = components[irradiance_type]
+    context = _get_context(timeseries, location, context)
+    is_night = context.night_mask
+    clearsky = context.clearsky[irradiance_type].to_numpy()
     
     # Mask of values that exceed an irradiance threshold:
     # Adjusted to compensate for lower values when irradiance is closer to 0.
-    day_threshold = np.maximum(clearsky * day_margin, clearsky + 50)
-    general_threshold = day_threshold
+    # Built in one array: day threshold, then night_threshold at night.
+    general_threshold = np.multiply(clearsky, day_margin)
+    np.maximum(general_threshold, clearsky + 50, out=general_threshold)
     general_threshold[is_night] = night_threshold
-    
-    is_day_outlier = ~is_night & (timeseries > day_threshold)
-    is_night_outlier = is_night & (timeseries > night_threshold)
 
-    mask = is_day_outlier | is_night_outlier
-    return mask, general_threshold
+    mask = timeseries.to_numpy() > general_threshold[_column_axis(timeseries)]
+    return (_wrap_mask(mask, timeseries),
+            pd.Series(general_threshold, index=timeseries.index,
+                      name=irradiance_type))
 
+@profiled("anomaly_linear")
 def anomaly_linear(timeseries: pd.Series,
                    location: pvlib.location.Location,
                    horizon: int = 120,
                    tolerance: float = 1,
-                   min_irradiance: float = 10):
-    
-    is_daytime = ~ get_night_mask(timeseries.index, location)
-    is_relevant = (timeseries.values >= min_irradiance) & is_daytime
-
+                   min_irradiance: float = 10,
+                   context: DetectionContext = None,
+                   residual_std: np.ndarray = None):
     """
     Adjust a linear curve to a rolling horizon to evaluate how good of a fit it
     is at each step. Ignores night values.
-    """
 
-    def linfit_score(series_sample) -> float:
-        t = np.arange(len(series_sample))
-        slope, intercept = np.polyfit(t, series_sample, 1)
+    An optional DetectionContext provides the night mask. residual_std can
+    be passed when rolling_linear_residual_std(timeseries.values, horizon)
+    was already computed, e.g. to sweep tolerance values.
+
+    timeseries can also be a DataFrame of co-located sensors sharing the
+    same index: the night mask is computed once, the rolling fit runs on
+    all columns together and a DataFrame mask is returned.
+    """
+    context = _get_context(timeseries, location, context)
+    is_daytime = context.is_daytime[_column_axis(timeseries)]
+    is_relevant = (timeseries.values >= min_irradiance) & is_daytime
 
-        # Calculate score and return:
-        x_fit = slope * t + intercept
-        return np.std(series_sample - x_fit)
+    # Use a moving window (residual std of the linear fit at each right edge):
+    if residual_std is None:
+        with stage("anomaly_linear.rolling_fit", len(timeseries)):
+            residual_std = rolling_linear_residual_std(timeseries.values,
+                                                       horizon)
+    is_linear = residual_std <= tolerance
 
-    # Use a moving window:
-    is_linear = timeseries.rolling(horizon).apply(
-        lambda s: linfit_score(s)) <= tolerance
-    
     # Index corresponds to right edge, so we fill the rest of the window:
-    for k in range(horizon, len(is_linear)):
-        if is_linear.iloc[k]:
-            is_linear.iloc[k - horizon] = True
+    with stage("anomaly_linear.backfill", len(timeseries)):
+        is_linear = backfill_window(is_linear, horizon)
+
+    return _wrap_mask(is_linear & is_relevant, timeseries)
+
+@profiled("anomaly_hampel")
+def anomaly_hampel(timeseries: pd.Series,
+                   window: int = 15,
+                   n_sigma: float = 3,
+                   min_deviation: float = 10):
+    """
+    Hampel filter: flags the samples that deviate from the median of the
+    window centered on them by more than n_sigma robust standard
+    deviations (1.4826 * MAD). Catches short spikes and dips that stay
+    within the clearsky envelope.
+
+    Args:
+        timeseries: The irradiance timeseries to check, or a DataFrame of
+            sensors (one column each).
+        window: Number of samples of the centered window (odd).
+        n_sigma: Number of robust standard deviations allowed.
+        min_deviation: Deviations below this value [W/m^2] are never
+            flagged, e.g. on flat night values where the MAD is 0.
+
+    Returns:
+        mask: A pandas Series with boolean values indicating anomalies
+            (a DataFrame with the same columns for a DataFrame input).
+            Samples within window // 2 of the ends are never flagged.
+    """
+    # Check input validity:
+    if window < 3 or window % 2 == 0:
+        raise ValueError("window must be an odd number of at least 3.")
+
+    values = timeseries.to_numpy(dtype=float)
+    mask = np.zeros(values.shape, dtype=bool)
+    half = window // 2
+    for column in range(values.shape[1] if values.ndim == 2 else 1):
+        column_values = values[:, column] if values.ndim == 2 else values
+        with stage("anomaly_hampel.rolling_median", len(column_values)):
+            median, mad = rolling_median_mad(column_values, window)
+
+        # Statistics of the window centered on each sample:
+        deviation = np.abs(column_values[:len(column_values) - half]
+                           - median[half:])
+        limit = np.maximum(1.4826 * n_sigma * mad[half:], min_deviation)
+        is_outlier = np.zeros(len(column_values), dtype=bool)
+        is_outlier[:len(column_values) - half] = deviation > limit
+        if values.ndim == 2:
+            mask[:, column] = is_outlier
+        else:
+            mask = is_outlier
+    return _wrap_mask(mask, timeseries)
+
+@profiled("anomaly_stuck")
+def anomaly_stuck(timeseries: pd.Series,
+                  location: pvlib.location.Location,
+                  min_length: int = 30,
+                  tolerance: float = 0,
+                  zero_threshold: float = 1,
+                  context: DetectionContext = None):
+    """
+    Flags daytime runs of a frozen sensor (consecutive values within
+    tolerance of each other) or of a dropout (values at or below
+    zero_threshold, or NaN) lasting at least min_length samples. Night
+    samples break the runs, so the zeros of the night are never flagged.
+
+    The series is run-length encoded in one vectorized pass: a sample
+    continues the run of the previous one, the run lengths come from the
+    positions where runs start, and np.repeat spreads each run's verdict
+    back onto its samples.
+
+    Args:
+        timeseries: The irradiance timeseries to check, or a DataFrame of
+            sensors (one column each) sharing the index and location.
+        location: The pvlib Location object representing the site.
+        min_length: Number of samples of the shortest run flagged.
+        tolerance: Largest change between consecutive samples of a frozen
+            run (0 for identical values).
+        zero_threshold: Values at or below it are dropouts.
+        context: Optional DetectionContext for timeseries.index and location,
+            to reuse its night mask.
+
+    Returns:
+        mask: A pandas Series with boolean values indicating anomalies
+            (a DataFrame with the same columns for a DataFrame input).
+    """
+    context = _get_context(timeseries, location, context)
+    values = timeseries.to_numpy(dtype=float)
+    is_daytime = np.broadcast_to(context.is_daytime[_column_axis(timeseries)],
+                                 values.shape)
+
+    # Frozen: same value as the previous sample, both in daytime.
+    is_same = np.zeros(values.shape, dtype=bool)
+    is_same[1:] = np.abs(np.diff(values, axis=0)) <= tolerance
+    is_same[1:] &= is_daytime[:-1]
+    is_same &= is_daytime
+    is_frozen = _long_runs(is_same, min_length) & is_daytime
+
+    # Dropout: zero or NaN in daytime.
+    with np.errstate(invalid="ignore"):
+        is_low = (np.isnan(values) | (values <= zero_threshold)) & is_daytime
+    continues_low = np.zeros(values.shape, dtype=bool)
+    continues_low[1:] = is_low[1:] & is_low[:-1]
+    is_dropout = _long_runs(continues_low, min_length) & is_low
+
+    return _wrap_mask(is_frozen | is_dropout, timeseries)
+
 
-    return is_linear & is_relevant
+def _long_runs(continues, min_length):
+    # Mask of the samples in runs of at least min_length samples, where a
+    # sample continues the run of the previous one where continues is True.
+    # Columns of a 2-D array are runs of their own (continues[0] is False).
+    flat = continues.ravel(order="F")
+    starts = np.flatnonzero(~flat)
+    lengths = np.diff(starts, append=len(flat))
+    is_long = np.repeat(lengths >= min_length, lengths)
+    return is_long.reshape(continues.shape, order="F")
 
 
 
@@ -110,7 +499,7 @@ if __name__ == "__main__":
 
     ghi = sdg.SyntheticIrradiance()
     ghi.add_sensor_disconnect()
-    linear_mask = anomaly_linear(ghi.series, 120, 1)
+    linear_mask = anomaly_linear(ghi.series, ghi.location, 120, 1)
 
 
     # Test night_mask
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pvlib
+
+if __name__ == "__main__":
+    from anomaly_detection import (DetectionContext, anomaly_clearsky,
+                                   anomaly_linear)
+    from load_data import load_dataset_cached, save_dataset
+    from solar_cache import SolarCache
+else:
+    from . anomaly_detection import (DetectionContext, anomaly_clearsky,
+                                     anomaly_linear)
+    from . load_data import load_dataset_cached, save_dataset
+    from . solar_cache import SolarCache
+
+
+# Detector parameters a manifest entry can override:
+DEFAULT_PARAMETERS = {"column": None,
+                      "irradiance_type": "ghi",
+                      "horizon": 120,
+                      "tolerance": 1,
+                      "day_margin": 1.25,
+                      "night_threshold": 10}
+
+
+def load_manifest(filepath) -> list:
+    """
+    Reads a batch manifest, as a CSV file (one site per row) or a JSON list.
+
+    Each site needs name, path, latitude, longitude and tz; altitude and
+    the keys of DEFAULT_PARAMETERS are optional.
+    """
+    if str(filepath).endswith(".json"):
+        with open(filepath) as file:
+            sites = json.load(file)
+    else:
+        sites = pd.read_csv(filepath).to_dict(orient="records")
+
+    required = ["name", "path", "latitude", "longitude", "tz"]
+    for number, site in enumerate(sites):
+        missing = [key for key in required if key not in site]
+        if missing:
+            raise ValueError(f"Manifest entry {number} is missing {missing}.")
+    names = [site["name"] for site in sites]
+    if len(set(names)) != len(names):
+        raise ValueError("Site names in the manifest must be unique.")
+    return sites
+
+
+def clean_site(site: dict, output_dir: str, cache_dir: str = None,
+               source_dir: str = None) -> dict:
+    """
+    Runs the clearsky and linear detectors on one site of a manifest and
+    stores its values and masks in output_dir/<name> (see save_dataset).
+
+    The site's CSV is read through its binary copy in source_dir (see
+    load_dataset_cached), ingested there if needed. Defaults to
+    output_dir/<name>/source.
+
+    Returns:
+        summary: dict with the site name, number of rows, flagged counts,
+            elapsed seconds and the error message if the site failed.
+    """
+    start = time.perf_counter()
+    summary = {"name": site["name"], "rows": 0, "clearsky_outliers": 0,
+               "linear_anomalies": 0, "seconds": 0.0, "error": ""}
+    try:
+        params = {key: _get(site, key, default)
+                  for key, default in DEFAULT_PARAMETERS.items()}
+        location = pvlib.location.Location(latitude=site["latitude"],
+                                           longitude=site["longitude"],
+                                           tz=site["tz"],
+                                           altitude=_get(site, "altitude", 0),
+                                           name=site["name"])
+
+        site_dir = os.path.join(output_dir, str(site["name"]))
+        data, _ = load_dataset_cached(
+            site["path"], site["tz"],
+            source_dir or os.path.join(site_dir, "source"), dtype="float64")
+        series = data[params["column"] or data.columns[0]].astype(float)
+
+        cache = SolarCache(cache_dir) if cache_dir else None
+        context = DetectionContext(series.index, location, cache=cache)
+        clearsky_mask, _ = anomaly_clearsky(series,
+                                            location,
+                                            params["irradiance_type"],
+                                            params["day_margin"],
+                                            params["night_threshold"],
+                                            context=context)
+        linear_mask = anomaly_linear(series,
+                                     location,
+                                     int(params["horizon"]),
+                                     params["tolerance"],
+                                     context=context)
+
+        save_dataset(site_dir,
+                     series,
+                     {"clearsky_outlier": clearsky_mask,
+                      "linear_anomaly": linear_mask})
+        summary.update(rows=len(series),
+                       clearsky_outliers=int(clearsky_mask.sum()),
+                       linear_anomalies=int(linear_mask.sum()))
+    except Exception as error:
+        # One broken site shouldn't stop the batch.
+        summary["error"] = f"{type(error).__name__}: {error}"
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def run_batch(manifest, output_dir: str, max_workers: int = None,
+              cache_dir: str = None) -> pd.DataFrame:
+    """
+    Cleans every site of a manifest in parallel on a process pool.
+
+    Sites are independent, so throughput scales with the number of cores.
+    Each input CSV is first ingested once into a binary copy under
+    output_dir/_sources (one per file and timezone), which every site
+    reading that file then opens memory-mapped. Results come back in
+    manifest order whatever the completion order, and a summary.csv with
+    one row per site is written to output_dir.
+
+    Args:
+        manifest: List of site dicts, or a path for load_manifest().
+        output_dir: Directory for the per-site datasets and the summary.
+        max_workers: Number of processes. Defaults to the number of cores.
+        cache_dir: Optional SolarCache directory shared by the workers.
+
+    Returns:
+        summary: pandas.DataFrame with one row per site.
+    """
+    sites = manifest if isinstance(manifest, list) else load_manifest(manifest)
+    os.makedirs(output_dir, exist_ok=True)
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(sites), 1))
+
+    # One binary copy per (file, timezone), ingested before any site reads
+    # it, so sites sharing a file neither repeat nor race on the ingest:
+    source_dirs = [_source_dir(output_dir, site) for site in sites]
+    sources = {source_dir: (site["path"], site["tz"])
+               for site, source_dir in zip(sites, source_dirs)}
+    paths, tzs = zip(*sources.values()) if sources else ((), ())
+
+    if max_workers == 1:
+        list(map(_ingest_source, paths, tzs, sources))
+        results = [clean_site(site, output_dir, cache_dir, source_dir)
+                   for site, source_dir in zip(sites, source_dirs)]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_ingest_source, paths, tzs, sources))
+            results = list(executor.map(clean_site,
+                                        sites,
+                                        [output_dir] * len(sites),
+                                        [cache_dir] * len(sites),
+                                        source_dirs))
+
+    summary = pd.DataFrame(results,
+                           columns=["name", "rows", "clearsky_outliers",
+                                    "linear_anomalies", "seconds", "error"])
+    summary.to_csv(os.path.join(output_dir, "summary.csv"), index=False)
+    return summary
+
+
+def _source_dir(output_dir, site):
+    # Binary copy directory of the site's CSV, shared by the sites reading
+    # the same file in the same timezone.
+    path = os.path.abspath(str(site["path"]))
+    digest = hashlib.sha256(f"{path}|{site['tz']}".encode()).hexdigest()
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_dir, "_sources", f"{name}_{digest[:12]}")
+
+
+def _ingest_source(path, tz, source_dir):
+    try:
+        load_dataset_cached(path, tz, source_dir, dtype="float64")
+    except Exception:
+        pass  # Reported by clean_site for each site of this file
+
+
+def _get(site, key, default):
+    # Manifest value, or the default when missing or empty (NaN in CSV).
+    value = site.get(key)
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return default
+    return value
@@ -0,0 +1,240 @@
+""" Benchmark suite of the detectors, the generator and the loaders.
+
+Every case runs on synthetic minute data from a seeded SyntheticPlan, at
+each size of SIZES (and each horizon for anomaly_linear). Results hold the
+best wall time of a few repeats and the peak memory traced by tracemalloc,
+and can be saved to JSON and compared against a baseline:
+
+    results = run_benchmarks(["1d", "30d"])
+    save_results(results, "benchmark.json")
+    regressions = compare_results(results, load_results("baseline.json"))
+
+or from the command line, see cli.py:
+
+    python -m scripts.cli benchmark --sizes 1d 30d --output benchmark.json
+    python -m scripts.cli benchmark --baseline benchmark.json
+"""
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pvlib
+
+if __name__ == "__main__":
+    import anomaly_detection as ad
+    from synthetic_data_generation import (SyntheticIrradiance, SyntheticPlan,
+                                           default_location)
+    from load_data import load_dataset, load_dataset_cached
+else:
+    from . import anomaly_detection as ad
+    from . synthetic_data_generation import (SyntheticIrradiance,
+                                             SyntheticPlan, default_location)
+    from . load_data import load_dataset, load_dataset_cached
+
+
+# Days of minute data per size:
+SIZES = {"1d": 1, "30d": 30, "365d": 365, "3650d": 3650}
+HORIZONS = [30, 120, 480]
+SEED = 0
+
+# A case is repeated until it ran for this long (at most MAX_REPEATS times),
+# and the best time is kept:
+TIME_BUDGET = 1.0
+MAX_REPEATS = 5
+
+
+def benchmark_cases(horizons: list = HORIZONS) -> list:
+    """
+    Returns the benchmark cases as (name, function) pairs. Each function
+    takes the data of one size (see _synthetic_data) and runs one stage.
+    """
+    cases = [
+        ("get_night_mask",
+         lambda data: ad.get_night_mask(data["series"].index,
+                                        data["location"])),
+        ("anomaly_clearsky",
+         lambda data: ad.anomaly_clearsky(data["series"],
+                                          data["location"],
+                                          "ghi")),
+        ("anomaly_hampel",
+         lambda data: ad.anomaly_hampel(data["series"])),
+        ("anomaly_stuck",
+         lambda data: ad.anomaly_stuck(data["series"], data["location"])),
+    ]
+    for horizon in horizons:
+        cases.append((f"anomaly_linear[horizon={horizon}]",
+                      lambda data, horizon=horizon: ad.anomaly_linear(
+                          data["series"], data["location"], horizon)))
+    cases += [
+        ("SyntheticIrradiance", _build_synthetic_irradiance),
+        ("SyntheticPlan.render",
+         lambda data: data["plan"].render(data["series"].index,
+                                          data["location"])),
+        ("load_dataset",
+         lambda data: load_dataset(data["csv_path"])),
+        ("load_dataset_cached",
+         lambda data: load_dataset_cached(data["csv_path"],
+                                          data["location"].tz)),
+    ]
+    return cases
+
+
+def run_benchmarks(sizes: list = None,
+                   horizons: list = HORIZONS,
+                   names: list = None,
+                   verbose: bool = True) -> dict:
+    """
+    Runs the benchmark cases at every size.
+
+    Args:
+        sizes: Keys of SIZES. Defaults to all of them.
+        horizons: Horizons of the anomaly_linear cases.
+        names: Only run the cases whose name starts with one of these.
+        verbose: Print each result as it is measured.
+
+    Returns:
+        results: dict with the environment ("meta") and, for each
+            "<case>@<size>" key, the rows, best seconds, number of repeats
+            and peak memory in MB.
+    """
+    sizes = list(SIZES) if sizes is None else sizes
+    cases = [(name, function) for name, function in benchmark_cases(horizons)
+             if names is None or name.startswith(tuple(names))]
+
+    results = {"meta": _environment(), "results": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            data = _synthetic_data(SIZES[size], tmp_dir)
+            for name, function in cases:
+                seconds, repeats, peak = _measure(function, data)
+                result = {"rows": len(data["series"]),
+                          "seconds": seconds,
+                          "repeats": repeats,
+                          "peak_mb": peak / 2**20}
+                results["results"][f"{name}@{size}"] = result
+                if verbose:
+                    print(_format_line(f"{name}@{size}", result), flush=True)
+    return results
+
+
+def compare_results(results: dict, baseline: dict,
+                    tolerance: float = 0.25,
+                    min_seconds: float = 0.005,
+                    min_mb: float = 1.0) -> list:
+    """
+    Flags the cases that got slower or use more memory than in baseline.
+
+    A case regressed when it exceeds its baseline by more than tolerance
+    (relative) and by more than min_seconds or min_mb (absolute), so tiny
+    cases don't flag timer noise.
+
+    Returns:
+        regressions: list of (key, metric, baseline value, new value).
+    """
+    regressions = []
+    for key, result in results["results"].items():
+        reference = baseline["results"].get(key)
+        if reference is None:
+            continue
+        for metric, minimum in [("seconds", min_seconds), ("peak_mb", min_mb)]:
+            old, new = reference[metric], result[metric]
+            if new > old * (1 + tolerance) and new - old > minimum:
+                regressions.append((key, metric, old, new))
+    return regressions
+
+
+def save_results(results: dict, filepath: str):
+    with open(filepath, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def load_results(filepath: str) -> dict:
+    with open(filepath) as file:
+        return json.load(file)
+
+
+def format_regressions(regressions: list) -> str:
+    return "\n".join(f"REGRESSION {key} {metric}: {old:.4g} -> {new:.4g} "
+                     f"({new / old:.2f}x)"
+                     for key, metric, old, new in regressions)
+
+
+def _format_line(key, result):
+    return (f"{key:<45} {result['rows']:>10,} rows "
+            f"{result['seconds'] * 1000:>11.1f} ms "
+            f"{result['peak_mb']:>9.1f} MB")
+
+
+def _measure(function, data):
+    # Peak memory of one traced run, then the best time of untraced runs.
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = np.inf
+    total = 0.0
+    repeats = 0
+    while repeats < MAX_REPEATS and (repeats == 0 or total < TIME_BUDGET):
+        start = time.perf_counter()
+        function(data)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+        repeats += 1
+    return best, repeats, peak
+
+
+def _synthetic_data(days, tmp_dir):
+    # Seeded minute data of the given number of days, with its CSV file.
+    location = default_location()
+    times = pd.date_range("2025-01-01",
+                          periods=int(days * 1440),
+                          freq="min",
+                          tz=location.tz)
+    plan = (SyntheticPlan(seed=SEED)
+            .sensor_disconnect()
+            .noise()
+            .outliers())
+    series, _, _ = plan.render(times, location, clearsky_step="15min")
+    series = series.rename("GHI")
+
+    csv_path = os.path.join(tmp_dir, f"synthetic_{days}d.csv")
+    frame = series.to_frame()
+    frame.index = times.tz_localize(None).rename("Timestamp")
+    frame.to_csv(csv_path)
+    # Ingest once, so load_dataset_cached measures the warm path:
+    load_dataset_cached(csv_path, location.tz)
+
+    return {"series": series, "location": location, "plan": plan,
+            "csv_path": csv_path}
+
+
+def _build_synthetic_irradiance(data):
+    ghi = SyntheticIrradiance(data["series"].index, data["location"],
+                              seed=SEED)
+    ghi.add_sensor_disconnect()
+    ghi.add_noise()
+    ghi.add_outliers()
+    return ghi
+
+
+def _environment():
+    return {"date": pd.Timestamp.now(tz="UTC").isoformat(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "pvlib": pvlib.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "seed": SEED}
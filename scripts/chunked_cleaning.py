@@ -0,0 +1,148 @@
+import pandas as pd
+import pvlib
+
+if __name__ == "__main__":
+    from utils import validate_pvlib_location
+    from anomaly_detection import (DetectionContext, anomaly_clearsky,
+                                   anomaly_linear)
+    from load_data import read_dataset_chunks
+else:
+    from . utils import validate_pvlib_location
+    from . anomaly_detection import (DetectionContext, anomaly_clearsky,
+                                     anomaly_linear)
+    from . load_data import read_dataset_chunks
+
+
+def clean_csv_in_chunks(input_path: str,
+                        output_path: str,
+                        location: pvlib.location.Location,
+                        chunksize: int = 100_000,
+                        columns: list = None,
+                        irradiance_type: str = "ghi",
+                        horizon: int = 120,
+                        tolerance: float = 1,
+                        day_margin: float = 1.25,
+                        night_threshold: float = 10,
+                        cache=None) -> dict:
+    """
+    Runs the clearsky and linear detectors over a CSV file chunk by chunk
+    and appends the cleaned values and masks to output_path.
+
+    The rolling linear fit needs the horizon - 1 samples before a window,
+    and its back-fill needs the horizon samples after it. A tail of
+    2 * horizon - 1 rows is carried from one chunk to the next, and each
+    row is written once those neighbours were read, so the masks are
+    identical to running the detectors on the whole file. Memory use
+    depends on chunksize, not on the file size.
+
+    Args:
+        input_path: CSV file with a "Timestamp" column and value columns.
+        output_path: CSV file to write. For each value column c it has c,
+            c_clean (NaN where flagged), c_clearsky_outlier and
+            c_linear_anomaly.
+        location: pvlib.location.Location of the site. Its tz is used to
+            localize the timestamps.
+        chunksize: Number of rows read at a time.
+        columns: Value columns to clean. Defaults to every column except
+            boolean ones and the ones named *_mask (the ground truth masks
+            of synthetic datasets).
+        irradiance_type: Clearsky component to compare to ('ghi', 'dni',
+            'dhi').
+        horizon, tolerance: Parameters of anomaly_linear.
+        day_margin, night_threshold: Parameters of anomaly_clearsky.
+        cache: Optional solar_cache.SolarCache.
+
+    Returns:
+        summary: dict with the number of rows and flagged values per column.
+    """
+    # Check input validity:
+    validate_pvlib_location(location)
+
+    summary = {"rows": 0}
+    tail = None
+    pending = 0  # Rows at the end of tail not written yet
+    is_first_write = True
+
+    chunks = read_dataset_chunks(input_path, location.tz, chunksize,
+                                 numeric=False)
+    for chunk, is_last in _with_last_flag(chunks):
+        if columns is None:
+            columns = [column for column in chunk
+                       if not _is_mask_column(chunk[column])]
+        chunk = chunk[columns].astype(float)
+        data = chunk if tail is None else pd.concat([tail, chunk])
+
+        # Rows before first_row were written with a previous chunk and are
+        # only here as context for the rolling windows:
+        first_row = len(data) - len(chunk) - pending
+        last_row = len(data) if is_last else max(first_row,
+                                                 len(data) - horizon)
+
+        if last_row > first_row:
+            cleaned = _clean_block(data, location, irradiance_type, horizon,
+                                   tolerance, day_margin, night_threshold,
+                                   cache)
+            cleaned = cleaned.iloc[first_row:last_row]
+            cleaned.to_csv(output_path,
+                           mode="w" if is_first_write else "a",
+                           header=is_first_write)
+            is_first_write = False
+            _update_summary(summary, cleaned, list(data.columns))
+
+        # Keep the unwritten rows plus horizon - 1 rows of context:
+        tail = data.iloc[max(0, last_row - (horizon - 1)):]
+        pending = len(data) - last_row
+
+    return summary
+
+
+def _clean_block(data, location, irradiance_type, horizon, tolerance,
+                 day_margin, night_threshold, cache):
+    context = DetectionContext(data.index, location, cache=cache)
+    cleaned = {}
+    for column in data.columns:
+        series = data[column]
+        clearsky_mask, _ = anomaly_clearsky(series,
+                                            location,
+                                            irradiance_type,
+                                            day_margin,
+                                            night_threshold,
+                                            context=context)
+        linear_mask = anomaly_linear(series,
+                                     location,
+                                     horizon,
+                                     tolerance,
+                                     context=context)
+        is_anomaly = clearsky_mask.to_numpy() | linear_mask.to_numpy()
+
+        cleaned[column] = series
+        cleaned[f"{column}_clean"] = series.where(~is_anomaly)
+        cleaned[f"{column}_clearsky_outlier"] = clearsky_mask
+        cleaned[f"{column}_linear_anomaly"] = linear_mask
+    return pd.DataFrame(cleaned, index=data.index)
+
+
+def _is_mask_column(column):
+    return (column.name.endswith("_mask")
+            or pd.api.types.is_bool_dtype(column.dtype))
+
+
+def _update_summary(summary, cleaned, columns):
+    summary["rows"] += len(cleaned)
+    for column in columns:
+        for name in ["clearsky_outlier", "linear_anomaly"]:
+            key = f"{column}_{name}"
+            summary[key] = summary.get(key, 0) + int(cleaned[key].sum())
+
+
+def _with_last_flag(iterable):
+    # Yields (item, is_last) pairs, looking one item ahead.
+    iterator = iter(iterable)
+    try:
+        previous = next(iterator)
+    except StopIteration:
+        return
+    for item in iterator:
+        yield previous, False
+        previous = item
+    yield previous, True
@@ -0,0 +1,485 @@
+""" Command line entry point, meant to run headless on servers:
+
+    python -m scripts.cli generate output.csv --start 2025-03-01 --end 2025-03-07 --seed 0
+    python -m scripts.cli detect data/public/realistic_ghi_data.csv -o masks.csv
+    python -m scripts.cli clean input.csv output.csv --chunksize 100000
+    python -m scripts.cli batch manifest.csv output_dir --workers 8
+    python -m scripts.cli benchmark --sizes 1d 30d --output benchmark.json
+    python -m scripts.cli gui data/public/realistic_ghi_data.csv
+    python -m scripts.cli serve --tcp-port 9000 -o flags.csv
+    python -m scripts.cli simulate --sensors 100 --days 1
+
+Only argparse is imported at startup. Each command imports the modules it
+needs when it runs, so pvlib is loaded only by commands that use it and
+matplotlib or PyQt5 only by --plot and gui.
+"""
+import sys
+import time
+import argparse
+import importlib
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not hasattr(args, "command"):
+        parser.print_help()
+        return 1
+    return args.command(args) or 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m scripts.cli",
+        description="Synthetic irradiance generation and anomaly detection.")
+    commands = parser.add_subparsers(title="commands")
+
+    generate = commands.add_parser(
+        "generate", help="Write a synthetic irradiance dataset.")
+    generate.add_argument("output", help="CSV file, or binary dataset "
+                                         "directory if not ending in .csv.")
+    _add_period_arguments(generate)
+    generate.add_argument("--noise-level", type=float, default=0.001)
+    generate.add_argument("--outlier-percentage", type=float, default=0.01)
+    generate.add_argument("--disconnect-ratio", type=float, default=0.15)
+    generate.add_argument("--events", type=int, default=4,
+                          help="Number of sensor disconnect events.")
+    generate.add_argument("--masks", action="store_true",
+                          help="Also write the ground truth masks.")
+    generate.add_argument("--seed", type=int, default=None)
+    generate.add_argument("--chunksize", type=int, default=525_600,
+                          help="Rows generated and written at a time.")
+    generate.add_argument("--clearsky-step", default=None,
+                          help="Interpolate the clearsky model from a "
+                               "coarse grid, e.g. 15min.")
+    _add_location_arguments(generate)
+    generate.set_defaults(command=run_generate)
+
+    detect = commands.add_parser(
+        "detect", help="Run the anomaly detectors on a CSV dataset.")
+    detect.add_argument("input", help="CSV file with a Timestamp column.")
+    detect.add_argument("-o", "--output", default=None,
+                        help="CSV file to write the masks to.")
+    detect.add_argument("--column", default=None,
+                        help="Value column (defaults to the first one).")
+    detect.add_argument("--cached", action="store_true",
+                        help="Load through a binary copy of the CSV.")
+    detect.add_argument("--plot", action="store_true",
+                        help="Plot the series and the anomalies.")
+    detect.add_argument("--profile", action="store_true",
+                        help="Print the time and memory of each stage.")
+    detect.add_argument("--hampel-window", type=int, default=None,
+                        help="Also run the Hampel filter with this (odd) "
+                             "window, e.g. 15.")
+    detect.add_argument("--result-cache", default=None,
+                        help="Directory of cached masks by day, so re-runs "
+                             "only compute the changed days.")
+    detect.add_argument("--stuck-length", type=int, default=None,
+                        help="Also flag frozen or dropped-out daytime runs "
+                             "of at least this many samples, e.g. 30.")
+    _add_location_arguments(detect)
+    _add_detector_arguments(detect)
+    detect.set_defaults(command=run_detect)
+
+    clean = commands.add_parser(
+        "clean", help="Clean a CSV dataset chunk by chunk.")
+    clean.add_argument("input", help="CSV file with a Timestamp column.")
+    clean.add_argument("output", help="CSV file to write.")
+    clean.add_argument("--chunksize", type=int, default=100_000)
+    clean.add_argument("--column", nargs="+", default=None,
+                       help="Value columns to clean (defaults to every "
+                            "column but the boolean and *_mask ones).")
+    _add_location_arguments(clean)
+    _add_detector_arguments(clean)
+    clean.set_defaults(command=run_clean)
+
+    batch = commands.add_parser(
+        "batch", help="Clean the sites of a manifest on a process pool.")
+    batch.add_argument("manifest", help="CSV or JSON manifest of sites.")
+    batch.add_argument("output_dir")
+    batch.add_argument("--workers", type=int, default=None)
+    batch.add_argument("--cache-dir", default=None,
+                       help="Solar geometry cache directory.")
+    batch.set_defaults(command=run_batch)
+
+    benchmark = commands.add_parser(
+        "benchmark", help="Time the detectors, generator and loaders on "
+                          "seeded synthetic data.")
+    benchmark.add_argument("--sizes", nargs="+", default=None,
+                           choices=["1d", "30d", "365d", "3650d"],
+                           help="Days of minute data (default: all).")
+    benchmark.add_argument("--horizons", type=int, nargs="+",
+                           default=[30, 120, 480])
+    benchmark.add_argument("--cases", nargs="+", default=None,
+                           help="Only run cases starting with these names.")
+    benchmark.add_argument("-o", "--output", default=None,
+                           help="JSON file to save the results to.")
+    benchmark.add_argument("--baseline", default=None,
+                           help="JSON results to flag regressions against.")
+    benchmark.add_argument("--tolerance", type=float, default=0.25,
+                           help="Relative slowdown flagged as a regression.")
+    benchmark.add_argument("--peak-rss", type=float, default=None,
+                           metavar="DAYS",
+                           help="Also print the peak RSS of the standard and "
+                                "low-memory detectors on DAYS of data.")
+    benchmark.set_defaults(command=run_benchmark)
+
+    gui = commands.add_parser(
+        "gui", help="Open the interactive anomaly detector.")
+    gui.add_argument("input", nargs="?", default=None,
+                     help="CSV dataset (synthetic data if omitted).")
+    gui.add_argument("--column", default=None)
+    _add_period_arguments(gui)
+    gui.add_argument("--precompute", action="store_true")
+    gui.add_argument("--profile", action="store_true",
+                     help="Show the time of each stage in the status bar.")
+    _add_location_arguments(gui)
+    gui.set_defaults(command=run_gui)
+
+    serve = commands.add_parser(
+        "serve", help="Run online detection on live sensor feeds.")
+    serve.add_argument("-o", "--output", default=None,
+                       help="CSV file to append the flagged records to.")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--tcp-port", type=int, default=None)
+    serve.add_argument("--udp-port", type=int, default=None)
+    serve.add_argument("--tail", nargs="+", default=[],
+                       help="Growing CSV files to follow, one per sensor.")
+    _add_location_arguments(serve)
+    _add_detector_arguments(serve)
+    serve.set_defaults(command=run_serve)
+
+    simulate = commands.add_parser(
+        "simulate", help="Replay synthetic sensors to a service, or measure "
+                         "throughput and latency locally.")
+    simulate.add_argument("--sensors", type=int, default=100)
+    simulate.add_argument("--days", type=float, default=1)
+    simulate.add_argument("--rate", type=float, default=None,
+                          help="Samples per second per sensor.")
+    simulate.add_argument("--seed", type=int, default=0)
+    simulate.add_argument("--host", default="127.0.0.1")
+    simulate.add_argument("--port", type=int, default=None,
+                          help="Service TCP port (runs one locally if not "
+                               "given).")
+    simulate.set_defaults(command=run_simulate)
+
+    tune = commands.add_parser(
+        "tune", help="Score detector parameter grids on seeded synthetic "
+                     "datasets.")
+    tune.add_argument("--datasets", type=int, default=8)
+    tune.add_argument("--days", type=float, default=30)
+    tune.add_argument("--seed", type=int, default=0)
+    tune.add_argument("--workers", type=int, default=None)
+    for name in ["horizon", "tolerance", "day-margin", "night-threshold"]:
+        tune.add_argument(f"--{name}", type=float, nargs="+", default=None,
+                          help="Values to try (default: tuning.DEFAULT_GRID).")
+    tune.add_argument("--top", type=int, default=10,
+                      help="Number of parameter sets to print.")
+    tune.add_argument("-o", "--output", default=None,
+                      help="CSV file to write every parameter set to.")
+    _add_location_arguments(tune)
+    tune.set_defaults(command=run_tune)
+
+    return parser
+
+
+def _add_period_arguments(parser):
+    parser.add_argument("--start", default="2025-03-01")
+    parser.add_argument("--end", default="2025-03-07")
+    parser.add_argument("--freq", default="min")
+
+
+def _add_location_arguments(parser):
+    # Defaults are the Frutillar site used across the project.
+    parser.add_argument("--latitude", type=float, default=-41.13941227780086)
+    parser.add_argument("--longitude", type=float, default=-73.02542294598776)
+    parser.add_argument("--altitude", type=float, default=0)
+    parser.add_argument("--tz", default="America/Santiago")
+    parser.add_argument("--irradiance-type", default="ghi",
+                        choices=["ghi", "dni", "dhi"])
+
+
+def _add_detector_arguments(parser):
+    parser.add_argument("--horizon", type=int, default=120)
+    parser.add_argument("--tolerance", type=float, default=1)
+    parser.add_argument("--day-margin", type=float, default=1.25)
+    parser.add_argument("--night-threshold", type=float, default=10)
+    parser.add_argument("--cache-dir", default=None,
+                        help="Solar geometry cache directory.")
+
+
+def _module(name):
+    # Lazy import of a module of the scripts folder.
+    return importlib.import_module(f"scripts.{name}")
+
+
+def _location(args):
+    import pvlib
+    return pvlib.location.Location(latitude=args.latitude,
+                                   longitude=args.longitude,
+                                   tz=args.tz,
+                                   altitude=args.altitude)
+
+
+def _read_series(args):
+    load_data = _module("load_data")
+    if getattr(args, "cached", False):
+        data, _ = load_data.load_dataset_cached(args.input, args.tz,
+                                                dtype="float64")
+    else:
+        import pandas as pd
+        data = pd.concat(load_data.read_dataset_chunks(args.input, args.tz))
+    return data[args.column or data.columns[0]]
+
+
+def _solar_cache(args):
+    if args.cache_dir is None:
+        return None
+    return _module("solar_cache").SolarCache(args.cache_dir)
+
+
+def _times(args):
+    import pandas as pd
+    return pd.date_range(args.start, args.end, freq=args.freq, tz=args.tz)
+
+
+def run_generate(args):
+    sdg = _module("synthetic_data_generation")
+
+    times = _times(args)
+    summary = sdg.write_synthetic_dataset(
+        args.output,
+        times,
+        _location(args),
+        seed=args.seed,
+        chunksize=args.chunksize,
+        irradiance_type=args.irradiance_type,
+        disconnect_ratio=args.disconnect_ratio,
+        num_events=args.events,
+        noise_level=args.noise_level,
+        outlier_percentage=args.outlier_percentage,
+        masks=args.masks,
+        clearsky_step=args.clearsky_step)
+    print(f"Wrote {summary['rows']:,} rows to {args.output}")
+
+
+def run_detect(args):
+    import pandas as pd
+    ad = _module("anomaly_detection")
+
+    profiler = _module("profiling").Profiler(memory=True)
+    if args.profile:
+        profiler.enable()
+
+    series = _read_series(args)
+    location = _location(args)
+    context = ad.DetectionContext(series.index, location,
+                                  cache=_solar_cache(args))
+    threshold = None
+    if args.result_cache is not None:
+        cache = _module("result_cache").ResultCache(args.result_cache)
+        clearsky_mask, linear_mask = cache.detect(series,
+                                                  location,
+                                                  args.irradiance_type,
+                                                  args.day_margin,
+                                                  args.night_threshold,
+                                                  args.horizon,
+                                                  args.tolerance)
+        print(f"{cache.stats['blocks']:,} days, "
+              f"{cache.stats['clearsky_computed']:,} clearsky and "
+              f"{cache.stats['linear_computed']:,} linear recomputed")
+    else:
+        clearsky_mask, threshold = ad.anomaly_clearsky(series,
+                                                       location,
+                                                       args.irradiance_type,
+                                                       args.day_margin,
+                                                       args.night_threshold,
+                                                       context=context)
+        linear_mask = ad.anomaly_linear(series,
+                                        location,
+                                        args.horizon,
+                                        args.tolerance,
+                                        context=context)
+    masks = pd.DataFrame({"clearsky_outlier": clearsky_mask,
+                          "linear_anomaly": linear_mask})
+    if args.hampel_window is not None:
+        masks["hampel_outlier"] = ad.anomaly_hampel(series,
+                                                    args.hampel_window)
+    if args.stuck_length is not None:
+        masks["stuck_sensor"] = ad.anomaly_stuck(series,
+                                                 location,
+                                                 args.stuck_length,
+                                                 context=context)
+    profiler.disable()
+
+    print(f"{len(series):,} rows, "
+          f"{int(clearsky_mask.sum()):,} clearsky outliers, "
+          f"{int(linear_mask.sum()):,} linear anomalies")
+    if args.hampel_window is not None:
+        print(f"{int(masks['hampel_outlier'].sum()):,} Hampel outliers")
+    if args.stuck_length is not None:
+        print(f"{int(masks['stuck_sensor'].sum()):,} stuck sensor samples")
+    if args.profile:
+        print(profiler.report().to_string(float_format="{:.4g}".format))
+    if args.output:
+        masks.index = series.index.rename("Timestamp")
+        masks.to_csv(args.output)
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+        plt.plot(series.index, series, ".", markersize=1.5, label="Irradiance")
+        if threshold is not None:
+            plt.plot(series.index, threshold, "k--", linewidth=0.5,
+                     label="Clearsky outlier threshold")
+        plt.plot(series.index[clearsky_mask], series[clearsky_mask], "g.",
+                 label="Clearsky outliers")
+        plt.plot(series.index[linear_mask], series[linear_mask], "r.",
+                 label="Linear anomaly (daytime)")
+        plt.legend()
+        plt.show()
+
+
+def run_clean(args):
+    chunked_cleaning = _module("chunked_cleaning")
+    summary = chunked_cleaning.clean_csv_in_chunks(
+        args.input,
+        args.output,
+        _location(args),
+        chunksize=args.chunksize,
+        columns=args.column,
+        irradiance_type=args.irradiance_type,
+        horizon=args.horizon,
+        tolerance=args.tolerance,
+        day_margin=args.day_margin,
+        night_threshold=args.night_threshold,
+        cache=_solar_cache(args))
+    print(summary)
+
+
+def run_batch(args):
+    batch_cleaning = _module("batch_cleaning")
+    summary = batch_cleaning.run_batch(args.manifest,
+                                       args.output_dir,
+                                       max_workers=args.workers,
+                                       cache_dir=args.cache_dir)
+    print(summary.to_string(index=False))
+    return int((summary["error"].fillna("") != "").any())
+
+
+def run_benchmark(args):
+    benchmarks = _module("benchmarks")
+    results = benchmarks.run_benchmarks(args.sizes, args.horizons, args.cases)
+    if args.output:
+        benchmarks.save_results(results, args.output)
+    if args.peak_rss is not None:
+        report = _module("low_memory").peak_rss_report(args.peak_rss)
+        for mode, megabytes in report.items():
+            print(f"peak RSS {mode:<10} {megabytes:,.0f} MB")
+    if args.baseline is None:
+        return 0
+
+    baseline = benchmarks.load_results(args.baseline)
+    regressions = benchmarks.compare_results(results, baseline,
+                                             args.tolerance)
+    if regressions:
+        print(benchmarks.format_regressions(regressions))
+    print(f"{len(regressions)} regressions against {args.baseline}")
+    return int(len(regressions) > 0)
+
+
+def run_gui(args):
+    from PyQt5.QtWidgets import QApplication
+    sdg = _module("synthetic_data_generation")
+    intplot = _module("interactive_plot")
+
+    location = _location(args)
+    if args.input is None:
+        series = sdg.SyntheticIrradiance(_times(args),
+                                         location).add_outliers()
+    else:
+        series = _read_series(args)
+
+    app = QApplication(sys.argv[:1])
+    window = intplot.AnomalyDetector(series, location,
+                                     precompute=args.precompute,
+                                     profile=args.profile)
+    window.show()
+    return app.exec_()
+
+
+def run_serve(args):
+    import asyncio
+    ingestion_service = _module("ingestion_service")
+
+    async def serve():
+        service = ingestion_service.IngestionService(
+            _location(args),
+            args.output,
+            detector_options={"irradiance_type": args.irradiance_type,
+                              "horizon": args.horizon,
+                              "tolerance": args.tolerance,
+                              "day_margin": args.day_margin,
+                              "night_threshold": args.night_threshold})
+        if args.tcp_port is not None:
+            await service.start_tcp(args.host, args.tcp_port)
+        if args.udp_port is not None:
+            await service.start_udp(args.host, args.udp_port)
+        for filepath in args.tail:
+            service.tail_csv(filepath, args.tz)
+        try:
+            await service.run()
+        finally:
+            print(service.stats())
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def run_simulate(args):
+    import asyncio
+    import pandas as pd
+    ingestion_service = _module("ingestion_service")
+
+    if args.port is None:
+        stats = asyncio.run(ingestion_service.measure_throughput(
+            args.sensors, args.days, args.rate, args.seed))
+        for key, value in stats.items():
+            print(f"{key:<20} {value:,.2f}")
+        return
+
+    location = _module("synthetic_data_generation").default_location()
+    times = pd.date_range("2025-03-01", periods=int(args.days * 1440),
+                          freq="min", tz=location.tz)
+    feeds = ingestion_service.synthetic_feeds(args.sensors, times, location,
+                                              args.seed)
+    start = time.perf_counter()
+    sent = asyncio.run(ingestion_service.simulate_sensors(
+        args.host, args.port, feeds, args.rate))
+    elapsed = time.perf_counter() - start
+    print(f"Sent {sent:,} lines in {elapsed:.2f} s "
+          f"({sent / elapsed:,.0f} lines/s)")
+
+
+def run_tune(args):
+    tuning = _module("tuning")
+    grid = {key: values for key, values in [
+        ("horizon", args.horizon and [int(value) for value in args.horizon]),
+        ("tolerance", args.tolerance),
+        ("day_margin", args.day_margin),
+        ("night_threshold", args.night_threshold)] if values}
+    results = tuning.tune_parameters(grid,
+                                     num_datasets=args.datasets,
+                                     days=args.days,
+                                     seed=args.seed,
+                                     location=_location(args),
+                                     irradiance_type=args.irradiance_type,
+                                     max_workers=args.workers)
+    print(results.head(args.top).to_string(float_format="{:.3f}".format))
+    if args.output:
+        results.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
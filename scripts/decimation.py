@@ -0,0 +1,80 @@
+import numpy as np
+
+
+def visible_slice(x: np.ndarray, x_min: float, x_max: float) -> slice:
+    """
+    Returns the slice of the sorted array x within [x_min, x_max], extended
+    by one sample on each side so lines reach the edges of the view.
+    """
+    start = max(np.searchsorted(x, x_min, side="left") - 1, 0)
+    stop = min(np.searchsorted(x, x_max, side="right") + 1, len(x))
+    return slice(start, max(start, stop))
+
+
+def minmax_indices(y: np.ndarray, num_bins: int) -> np.ndarray:
+    """
+    Min/max decimation: splits y into num_bins consecutive bins and keeps
+    the positions of the minimum and maximum of each one, in order.
+
+    Plotted at one bin per pixel column, the result looks the same as the
+    full data while its size depends only on the number of bins.
+
+    Args:
+        y: 1-D array of values (NaN are ignored).
+        num_bins: Number of bins, e.g. the plot width in pixels.
+
+    Returns:
+        indices: sorted positions into y, at most 2 * num_bins of them.
+    """
+    y = np.asarray(y, dtype=float)
+    num_bins = max(int(num_bins), 1)
+    if len(y) <= 2 * num_bins:
+        return np.arange(len(y))
+
+    # Equal bins of bin_size samples, the remainder forms a last short bin:
+    bin_size = -(-len(y) // num_bins)
+    num_full = len(y) // bin_size
+    full = y[:num_full * bin_size].reshape(num_full, bin_size)
+    offsets = np.arange(num_full) * bin_size
+
+    is_nan = np.isnan(full)
+    lows = np.where(is_nan, np.inf, full).argmin(axis=1) + offsets
+    highs = np.where(is_nan, -np.inf, full).argmax(axis=1) + offsets
+    indices = [lows, highs]
+
+    rest = y[num_full * bin_size:]
+    if len(rest) > 0 and not np.isnan(rest).all():
+        first = num_full * bin_size
+        indices.append([np.nanargmin(rest) + first, np.nanargmax(rest) + first])
+
+    # Bins made only of NaN point to their first sample, which is fine to
+    # keep: a NaN isn't drawn.
+    return np.unique(np.concatenate(indices))
+
+
+def decimate(x: np.ndarray,
+             y: np.ndarray,
+             x_min: float,
+             x_max: float,
+             num_bins: int,
+             mask: np.ndarray = None):
+    """
+    Min/max decimation of the samples of (x, y) visible in [x_min, x_max].
+
+    Args:
+        x: sorted 1-D array of positions (e.g. matplotlib date numbers).
+        y: 1-D array of values.
+        x_min, x_max: current view limits.
+        num_bins: Number of bins, e.g. the plot width in pixels.
+        mask: optional boolean array selecting the samples to decimate.
+
+    Returns:
+        x, y: decimated arrays.
+    """
+    view = visible_slice(x, x_min, x_max)
+    if mask is None:
+        positions = view.start + minmax_indices(y[view], num_bins)
+    else:
+        positions = view.start + np.flatnonzero(mask[view])
+        positions = positions[minmax_indices(y[positions], num_bins)]
+    return x[positions], y[positions]
@@ -0,0 +1,406 @@
+""" Asyncio ingestion service for live sensor feeds, and a feed simulator.
+
+Readings are lines of "sensor_id,timestamp,value", with the timestamp as
+int nanoseconds since epoch or an ISO string with a UTC offset. They
+arrive over TCP, UDP or from growing CSV files, and each sensor gets its
+own online_detection.OnlineDetector. Flagged and cleaned records are
+appended to an output CSV file:
+
+    sensor,timestamp,value,flags,clean,kind
+
+where kind is "sample", or "correction" for the late linear flags of an
+earlier sample (see OnlineDetector).
+
+    service = IngestionService(location, "flags.csv")
+    await service.start_tcp("127.0.0.1", 9000)
+    await service.run()
+
+measure_throughput() runs the service and simulate_sensors() in one
+process to report sustained throughput and latency.
+"""
+import os
+import time
+import asyncio
+from collections import deque
+import numpy as np
+import pandas as pd
+import pvlib
+
+if __name__ == "__main__":
+    from online_detection import OnlineDetector
+    from load_data import (parse_timestamps, count_ambiguous_tail,
+                           TIMESTAMP_FORMAT)
+    from synthetic_data_generation import SyntheticIrradiance, default_location
+else:
+    from . online_detection import OnlineDetector
+    from . load_data import (parse_timestamps, count_ambiguous_tail,
+                             TIMESTAMP_FORMAT)
+    from . synthetic_data_generation import (SyntheticIrradiance,
+                                             default_location)
+
+
+OUTPUT_HEADER = "sensor,timestamp,value,flags,clean,kind\n"
+
+
+class IngestionService:
+    """
+    Receives readings from many sensors and runs the online detectors on
+    them in batches.
+
+    Sources put batches of parsed readings in a bounded queue, consumed by
+    run(). When the queue is full, TCP and CSV sources wait before reading
+    more, so TCP flow control slows down the senders (backpressure). UDP
+    can't wait: its datagrams are dropped and counted instead.
+
+    Args:
+        location: pvlib.location.Location of the sensors not in sensors.
+        output_path: CSV file the records are appended to (None to only
+            keep the counters, e.g. for benchmarks).
+        sensors: Optional dict of sensor id -> pvlib.location.Location.
+        queue_size: Number of batches the queue holds before pushing back.
+        detector_options: Keyword arguments of OnlineDetector.
+    """
+
+    def __init__(self,
+                 location: pvlib.location.Location = None,
+                 output_path: str = None,
+                 sensors: dict = None,
+                 queue_size: int = 256,
+                 detector_options: dict = None):
+        self.location = location or default_location()
+        self.output_path = output_path
+        self.sensors = sensors or {}
+        self.detector_options = detector_options or {}
+        self.detectors = {}
+        self.day_cache = {}  # Daily solar features shared by the sensors
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.servers = []
+        self.tasks = []  # CSV tails
+        self.connections = set()  # Open TCP connections
+
+        # Counters, and (latency, records) of the last batches:
+        self.counts = {"records": 0, "flagged": 0, "corrections": 0,
+                       "rejected": 0, "dropped": 0, "batches": 0}
+        self.latencies = deque(maxlen=100_000)
+        self.started = None
+
+    async def start_tcp(self, host: str = "127.0.0.1", port: int = 9000):
+        # Returns the server; port=0 picks a free port.
+        server = await asyncio.start_server(self._handle_tcp, host, port)
+        self.servers.append(server)
+        return server
+
+    async def start_udp(self, host: str = "127.0.0.1", port: int = 9001):
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(self), local_addr=(host, port))
+        self.servers.append(transport)
+        return transport
+
+    def tail_csv(self, filepath: str, tz: str, sensor_id: str = None,
+                 poll_interval: float = 0.5, from_start: bool = True):
+        """
+        Follows a growing CSV file in the format of data/public (Timestamp
+        column of naive local times, then a value column). The sensor id
+        defaults to the file name without extension.
+        """
+        sensor_id = sensor_id or os.path.splitext(os.path.basename(filepath))[0]
+        task = asyncio.ensure_future(self._tail(filepath, tz, sensor_id,
+                                                poll_interval, from_start))
+        self.tasks.append(task)
+        return task
+
+    async def run(self):
+        """
+        Consumes the queue until stop() is called: each batch is run through
+        the detectors of its sensors and written out at once.
+        """
+        self.started = time.perf_counter()
+        output = None
+        if self.output_path is not None:
+            is_new = not os.path.exists(self.output_path)
+            output = open(self.output_path, "a")
+            if is_new:
+                output.write(OUTPUT_HEADER)
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is None:
+                    break
+                received, readings = item
+                lines = self._process(readings)
+                if output is not None:
+                    output.write("".join(lines))
+                self.latencies.append((time.perf_counter() - received,
+                                       len(readings)))
+                self.counts["batches"] += 1
+        finally:
+            if output is not None:
+                output.close()
+
+    async def stop(self, drain: bool = True):
+        # Closes the sources, then lets run() finish the queued batches.
+        # With drain, open TCP connections are read to the end first.
+        for server in self.servers:
+            server.close()
+        for task in self.tasks:
+            task.cancel()
+        if drain:
+            await asyncio.gather(*self.connections, return_exceptions=True)
+            await self.queue.put(None)
+        else:
+            for task in self.connections:
+                task.cancel()
+            self.queue.put_nowait(None)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            stats: counters, records per second since run() started, and
+                latency percentiles in ms (time from receiving a batch to
+                writing its records, queueing included). records counts
+                the readings run through the detectors, rejected the
+                malformed and out-of-order ones.
+        """
+        stats = dict(self.counts)
+        if self.started is not None:
+            elapsed = time.perf_counter() - self.started
+            stats["records_per_second"] = self.counts["records"] / elapsed
+        if self.latencies:
+            latency, weight = np.array(self.latencies).T
+            latency = np.repeat(latency, weight.astype(int)) * 1000
+            for name, q in [("p50", 50), ("p99", 99), ("p999", 99.9)]:
+                stats[f"latency_{name}_ms"] = float(np.percentile(latency, q))
+            stats["latency_max_ms"] = float(latency.max())
+        return stats
+
+    def _detector(self, sensor):
+        detector = self.detectors.get(sensor)
+        if detector is None:
+            location = self.sensors.get(sensor, self.location)
+            detector = OnlineDetector(location, day_cache=self.day_cache,
+                                      **self.detector_options)
+            self.detectors[sensor] = detector
+        return detector
+
+    def _process(self, readings):
+        # Runs the detectors on a batch, returns the output lines.
+        lines = []
+        for sensor, t, value in readings:
+            detector = self._detector(sensor)
+            try:
+                flags = detector.update(t, value)
+            except ValueError:
+                self.counts["rejected"] += 1  # Out of order
+                continue
+            self.counts["records"] += 1
+            clean = "" if flags or value != value else value
+            lines.append(f"{sensor},{t},{value},{flags},{clean},sample\n")
+            self.counts["flagged"] += flags > 0
+            if detector.corrections:
+                for time_ns, flag in detector.pop_corrections():
+                    lines.append(f"{sensor},{time_ns},,{flag},,correction\n")
+                    self.counts["corrections"] += 1
+        return lines
+
+    async def _handle_tcp(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        rest = b""
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                lines = (rest + data).split(b"\n")
+                rest = lines.pop()
+                readings = self._parse_lines(lines)
+                if readings:
+                    # Waits while the queue is full: backpressure.
+                    await self.queue.put((time.perf_counter(), readings))
+            readings = self._parse_lines([rest])
+            if readings:
+                await self.queue.put((time.perf_counter(), readings))
+        finally:
+            writer.close()
+            self.connections.discard(task)
+
+    async def _tail(self, filepath, tz, sensor_id, poll_interval, from_start):
+        with open(filepath) as file:
+            if not from_start:
+                file.seek(0, os.SEEK_END)
+            rest = ""
+            while True:
+                data = file.read(1 << 20)
+                if not data:
+                    await asyncio.sleep(poll_interval)
+                    continue
+                lines = (rest + data).split("\n")
+                rest = lines.pop()
+                lines = [line for line in lines
+                         if line and not line.startswith("Timestamp")]
+                # Rows of a repeated DST hour wait for the rest of the hour:
+                held = count_ambiguous_tail([line.split(",")[0]
+                                             for line in lines],
+                                            tz, TIMESTAMP_FORMAT)
+                if held:
+                    rest = "\n".join(lines[len(lines) - held:] + [rest])
+                    lines = lines[:len(lines) - held]
+                readings = self._parse_rows([line.split(",")
+                                             for line in lines],
+                                            tz, sensor_id)
+                if readings:
+                    await self.queue.put((time.perf_counter(), readings))
+
+    def _parse_lines(self, lines):
+        # "sensor_id,timestamp,value" lines to (sensor, ns, value) tuples.
+        # Malformed lines are counted as rejected and skipped.
+        readings = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                sensor, timestamp, value = line.decode().split(",")
+                try:
+                    t = int(timestamp)
+                except ValueError:
+                    t = pd.Timestamp(timestamp).value
+                readings.append((sensor, t, float(value) if value else np.nan))
+            except ValueError:
+                self.counts["rejected"] += 1
+        return readings
+
+    def _parse_rows(self, rows, tz, sensor_id):
+        # CSV rows of a tailed file to readings, skipping malformed rows.
+        try:
+            times = parse_timestamps([row[0] for row in rows], tz,
+                                     TIMESTAMP_FORMAT).asi8.tolist()
+        except ValueError:
+            # Find the bad timestamps one row at a time:
+            times = []
+            for row in rows:
+                try:
+                    times.append(parse_timestamps([row[0]], tz,
+                                                  TIMESTAMP_FORMAT).asi8[0])
+                except ValueError:
+                    times.append(None)
+        readings = []
+        for t, row in zip(times, rows):
+            try:
+                if t is None or len(row) < 2:
+                    raise ValueError("Malformed row.")
+                readings.append((sensor_id, int(t),
+                                 float(row[1]) if row[1] else np.nan))
+            except ValueError:
+                self.counts["rejected"] += 1
+        return readings
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, service):
+        self.service = service
+
+    def datagram_received(self, data, addr):
+        readings = self.service._parse_lines(data.split(b"\n"))
+        if not readings:
+            return
+        try:
+            self.service.queue.put_nowait((time.perf_counter(), readings))
+        except asyncio.QueueFull:
+            self.service.counts["dropped"] += len(readings)
+
+
+def synthetic_feeds(num_sensors: int,
+                    times: pd.DatetimeIndex = None,
+                    location: pvlib.location.Location = None,
+                    seed: int = 0) -> dict:
+    """
+    Renders one SyntheticIrradiance per sensor (each with its own child
+    seed) as the lines it would send.
+
+    Returns:
+        feeds: dict of sensor id -> list of bytes lines.
+    """
+    location = location or default_location()
+    if times is None:
+        times = pd.date_range("2025-03-01", periods=1440, freq="min",
+                              tz=location.tz)
+    ns = times.as_unit("ns").asi8.tolist()
+    feeds = {}
+    seeds = np.random.SeedSequence(seed).spawn(num_sensors)
+    for number, sensor_seed in enumerate(seeds):
+        sensor = f"sensor{number:04d}"
+        ghi = SyntheticIrradiance(times, location, clearsky_step="15min",
+                                  seed=sensor_seed)
+        ghi.add_sensor_disconnect()
+        ghi.add_noise()
+        ghi.add_outliers()
+        feeds[sensor] = [f"{sensor},{t},{value:.3f}\n".encode()
+                         for t, value in zip(ns, ghi.values.tolist())]
+    return feeds
+
+
+async def simulate_sensors(host: str,
+                           port: int,
+                           feeds: dict,
+                           rate: float = None,
+                           lines_per_write: int = 60) -> int:
+    """
+    Replays feeds (see synthetic_feeds) as concurrent TCP sensors, one
+    connection each.
+
+    Args:
+        host, port: Address of the service.
+        feeds: dict of sensor id -> lines.
+        rate: Samples per second per sensor, or None to send as fast as the
+            service accepts them.
+        lines_per_write: Lines sent per write.
+
+    Returns:
+        sent: Total number of lines sent.
+    """
+    async def replay(lines):
+        _, writer = await asyncio.open_connection(host, port)
+        start = time.perf_counter()
+        for first in range(0, len(lines), lines_per_write):
+            writer.write(b"".join(lines[first:first + lines_per_write]))
+            await writer.drain()  # Blocks when the service pushes back
+            if rate is not None:
+                ahead = first / rate - (time.perf_counter() - start)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        writer.close()
+        await writer.wait_closed()
+        return len(lines)
+
+    sent = await asyncio.gather(*(replay(lines) for lines in feeds.values()))
+    return sum(sent)
+
+
+async def measure_throughput(num_sensors: int = 100,
+                             days: float = 1,
+                             rate: float = None,
+                             seed: int = 0,
+                             output_path: str = None) -> dict:
+    """
+    Runs the service on a local TCP port and replays num_sensors synthetic
+    sensors of days of minute data through it.
+
+    Returns:
+        stats: IngestionService.stats() once every line was processed.
+    """
+    location = default_location()
+    times = pd.date_range("2025-03-01", periods=int(days * 1440),
+                          freq="min", tz=location.tz)
+    feeds = synthetic_feeds(num_sensors, times, location, seed)
+
+    service = IngestionService(location, output_path)
+    server = await service.start_tcp("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    consumer = asyncio.ensure_future(service.run())
+
+    await simulate_sensors("127.0.0.1", port, feeds, rate)
+    await service.stop()
+    await consumer
+    return service.stats()
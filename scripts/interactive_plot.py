@@ -1,11 +1,54 @@
 import sys
+import time
+import threading
+from collections import OrderedDict
 import numpy as np
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QPushButton, QSlider, QLabel
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 
 if not __name__ == "__main__":
     from . import anomaly_detection as ad
+    from . linear_fit import rolling_linear_residual_std
+    from . decimation import decimate
+    from . profiling import Profiler, stage
+
+
+class DetectionSignals(QObject):
+    # Emitted from the worker thread, delivered on the GUI thread.
+    finished = pyqtSignal(int, object, float)  # job id, results, seconds
+    failed = pyqtSignal(int, str)  # job id, error message
+
+
+class DetectionJob(QRunnable):
+    """
+    Runs detect(**params) on a worker thread. Jobs that became stale (a newer
+    parameter set was requested) are skipped before starting, and their
+    results are dropped instead of emitted.
+    """
+    def __init__(self, job_id, detect, params, is_stale, signals):
+        super().__init__()
+        self.job_id = job_id
+        self.detect = detect
+        self.params = params
+        self.is_stale = is_stale
+        self.signals = signals
+
+    def run(self):
+        if self.is_stale(self.job_id):
+            return
+        start = time.perf_counter()
+        try:
+            results = self.detect(**self.params)
+        except Exception as error:
+            self.signals.failed.emit(self.job_id, str(error))
+            return
+        if not self.is_stale(self.job_id):
+            self.signals.finished.emit(self.job_id,
+                                       results,
+                                       time.perf_counter() - start)
 
 
 class AnomalyDetector(QWidget):
@@ -15,7 +58,11 @@ class AnomalyDetector(QWidget):
                  horizon=120,
                  tolerance=1,
                  night_tol=10,
-                 outlier_tol = 1.2):
+                 outlier_tol = 1.2,
+                 debounce_ms=150,
+                 precompute=False,
+                 cache_size=28,
+                 profile=False):
         super().__init__()
         self.series = irradiance_series
         self.horizon = horizon
@@ -23,6 +70,42 @@ class AnomalyDetector(QWidget):
         self.night_tol = night_tol
         self.outlier_tol = outlier_tol
         self.location = location
+
+        # Night mask and clearsky don't depend on the sliders: compute once.
+        self.context = ad.DetectionContext(self.series.index, self.location)
+
+        # Detection runs on a single worker thread; slider moves are
+        # debounced and only the latest parameter set gets rendered.
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.job_id = 0
+        self.signals = DetectionSignals()
+        self.signals.finished.connect(self.on_detection_finished)
+        self.signals.failed.connect(self.on_detection_failed)
+
+        self.debounce_timer = QTimer()
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(debounce_ms)
+        self.debounce_timer.timeout.connect(self.start_detection)
+
+        # Precompute mode: residual std arrays per horizon (LRU cache) and
+        # the clearsky baseline are built up front on a second worker, so
+        # slider moves only compare against thresholds.
+        self.precompute = precompute
+        self.cache_size = cache_size
+        self.residual_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.closing = False
+        self.precompute_pool = QThreadPool()
+        self.precompute_pool.setMaxThreadCount(1)
+        self.precompute_signals = DetectionSignals()
+        self.precompute_signals.finished.connect(self.on_precompute_finished)
+        self.precompute_signals.failed.connect(self.on_precompute_failed)
+
+        # Profile mode: per stage timings of each detection in the status bar
+        self.profiler = Profiler().enable() if profile else None
+        self.profile_mark = 0
+
         self.initUI()
         
     def initUI(self):
@@ -89,9 +172,21 @@ class AnomalyDetector(QWidget):
         self.figure, self.ax = plt.subplots()
         self.canvas = FigureCanvas(self.figure)
         layout.addWidget(self.canvas)
+        self.init_artists()
+
+        # Busy/timing indicator
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+
+        # Precompute progress, kept apart from the detection result:
+        self.precompute_label = QLabel("")
+        if self.precompute:
+            layout.addWidget(self.precompute_label)
         
         # Initial plot
-        self.update_plot()
+        self.start_detection()
+        if self.precompute:
+            self.start_precompute()
         
         self.setLayout(layout)
     
@@ -106,62 +201,218 @@ class AnomalyDetector(QWidget):
         self.night_label.setText(f"Lower threshold: {self.night_tol} [W/m^2]")
         self.outlier_tol_label.setText(f"Outlier tolerance: {self.outlier_tol:.0%}")
 
+        # Re-run detection and update plot once the slider settles:
+        self.debounce_timer.start()
 
-        self.update_plot()  # Re-run detection and update plot
-    
-    def update_plot(self):
+    def detection_params(self):
+        return {"horizon": self.horizon,
+                "tolerance": self.tolerance,
+                "night_tol": self.night_tol,
+                "outlier_tol": self.outlier_tol}
+
+    def detect(self, horizon, tolerance, night_tol, outlier_tol):
+        # Safe to run on the worker thread: doesn't touch any widget.
+        residual_std = self.residual_std(horizon) if self.precompute else None
         anomaly_mask = ad.anomaly_linear(self.series,
                                          self.location,
-                                         self.horizon,
-                                         self.tolerance)
+                                         horizon,
+                                         tolerance,
+                                         context=self.context,
+                                         residual_std=residual_std)
         
         anomaly_mask2, csky_threshold = ad.anomaly_clearsky(self.series,
                                                             self.location,
                                                             "ghi",
-                                                            self.outlier_tol,
-                                                            self.night_tol)
-
-        self.ax.clear()
-        self.ax.plot(self.series.index,
-                     self.series,
-                     '.',
-                     markersize=1.5,
-                     label="Irradiance",
-                     color="blue")
+                                                            outlier_tol,
+                                                            night_tol,
+                                                            context=self.context)
+        return anomaly_mask, anomaly_mask2, csky_threshold
+
+    def residual_std(self, horizon):
+        """ Rolling linear fit residual std for horizon, from the LRU cache. """
+        with self.cache_lock:
+            if horizon in self.residual_cache:
+                self.residual_cache.move_to_end(horizon)
+                return self.residual_cache[horizon]
+
+        residual_std = rolling_linear_residual_std(self.series.values, horizon)
+        with self.cache_lock:
+            self.residual_cache[horizon] = residual_std
+            while len(self.residual_cache) > self.cache_size:
+                self.residual_cache.popitem(last=False)
+        return residual_std
+
+    def slider_horizons(self):
+        # Remember to change scale in update_parameters() too
+        return [10 * value for value in range(self.horizon_slider.minimum(),
+                                              self.horizon_slider.maximum() + 1)]
+
+    def precompute_features(self, horizons):
+        # Clearsky baseline and night mask don't depend on any slider:
+        self.context.night_mask
+        self.context.clearsky
+        for horizon in horizons[:self.cache_size]:
+            if self.closing:
+                break
+            self.residual_std(horizon)
+        return len(self.residual_cache)
+
+    def start_precompute(self):
+        # Horizons closest to the current one are computed first.
+        horizons = sorted(self.slider_horizons(),
+                          key=lambda horizon: abs(horizon - self.horizon))
+        job = DetectionJob(0,
+                           self.precompute_features,
+                           {"horizons": horizons},
+                           lambda job_id: self.closing,
+                           self.precompute_signals)
+        self.precompute_label.setText("Precomputing horizons...")
+        self.precompute_pool.start(job)
+
+    def on_precompute_finished(self, job_id, num_horizons, elapsed):
+        self.precompute_label.setText(f"Precomputed {num_horizons} horizons "
+                                      f"in {elapsed:.2f} s")
+
+    def on_precompute_failed(self, job_id, message):
+        self.precompute_label.setText(f"Precompute failed: {message}")
+
+    def start_detection(self):
+        # Newer jobs make queued and running ones stale:
+        self.job_id += 1
+        self.pool.clear()
+        if self.profiler is not None:
+            self.profile_mark = self.profiler.mark()
+        job = DetectionJob(self.job_id,
+                           self.detect,
+                           self.detection_params(),
+                           lambda job_id: job_id != self.job_id,
+                           self.signals)
+        self.status_label.setText("Running detection...")
+        self.pool.start(job)
+
+    def on_detection_finished(self, job_id, results, elapsed):
+        if job_id != self.job_id:
+            return  # A newer parameter set is on its way
+        start = time.perf_counter()
+        self.draw_results(*results)
+        draw_time = time.perf_counter() - start
+        status = (f"{len(self.series):,} points - "
+                  f"detection: {elapsed * 1000:.0f} ms, "
+                  f"plot: {draw_time * 1000:.0f} ms")
+        if self.profiler is not None:
+            status += "\n" + self.profiler.summary(self.profile_mark)
+        self.status_label.setText(status)
+
+    def on_detection_failed(self, job_id, message):
+        if job_id == self.job_id:
+            self.status_label.setText(f"Detection failed: {message}")
+
+    def update_plot(self):
+        # Synchronous detection and redraw with the current parameters.
+        self.draw_results(*self.detect(**self.detection_params()))
+
+    def init_artists(self):
+        # Artists are created once and updated with decimated data, so a
+        # redraw costs about the same for any length of the series.
+        times = self.series.index.tz_convert("UTC").tz_localize(None)
+        self.x = mdates.date2num(times.to_numpy())
+        self.y = self.series.to_numpy(dtype=float)
+        self.results = None
+
+        self.raw_line, = self.ax.plot([], [],
+                                      '.',
+                                      markersize=1.5,
+                                      label="Irradiance",
+                                      color="blue")
         
-        self.ax.scatter(self.series.index[anomaly_mask2],
-                        self.series.loc[anomaly_mask2],
-                        label="Clearsky outliers",
-                        color="green")
-
-        self.ax.plot(self.series.index,
-                     csky_threshold,
-                     linestyle="dashed",                     
-                     label="Clearsky outlier threshold",
-                     color="black",
-                     linewidth=0.5)
+        self.clearsky_scatter = self.ax.scatter([], [],
+                                                label="Clearsky outliers",
+                                                color="green")
+
+        self.threshold_line, = self.ax.plot([], [],
+                                            linestyle="dashed",
+                                            label="Clearsky outlier threshold",
+                                            color="black",
+                                            linewidth=0.5)
         
-        self.ax.scatter(self.series.index[anomaly_mask],
-                        self.series.loc[anomaly_mask],
-                        label="Linear anomaly (daytime)",
-                        color="red")
+        self.linear_scatter = self.ax.scatter([], [],
+                                              label="Linear anomaly (daytime)",
+                                              color="red")
         
-        self.ax.scatter(self.series.index[anomaly_mask & anomaly_mask2],
-                        self.series.loc[anomaly_mask & anomaly_mask2],
-                        label="Both",
-                        color="purple")
+        self.both_scatter = self.ax.scatter([], [],
+                                            label="Both",
+                                            color="purple")
         
+        self.ax.xaxis_date(tz=self.series.index.tz)
         self.ax.legend()
         self.ax.set_xlabel("Time")
         self.ax.set_ylabel("Irradiance")
         self.ax.set_title("Anomaly detection example")
-        
-        self.canvas.draw()
+
+        # Re-decimate for the new view when the user zooms or pans:
+        self.ax.callbacks.connect("xlim_changed", self.on_xlim_changed)
+
+    def draw_results(self, anomaly_mask, anomaly_mask2, csky_threshold):
+        with stage("plot", len(self.x)):
+            self.results = (np.asarray(anomaly_mask, dtype=bool),
+                            np.asarray(anomaly_mask2, dtype=bool),
+                            np.asarray(csky_threshold, dtype=float))
+            is_first_draw = not self.raw_line.get_xdata().size
+            self.render_view()
+
+            if is_first_draw and len(self.x) > 0:
+                # Decimation keeps the extremes, so autoscaling still fits
+                self.ax.relim()
+                self.ax.autoscale_view()
+                self.ax.set_xlim(self.x[0], self.x[-1])
+
+            self.canvas.draw_idle()
+
+    def render_view(self):
+        # Min/max decimation of the visible samples, one bin per pixel column.
+        if self.results is None:
+            return
+        linear_mask, clearsky_mask, threshold = self.results
+        x_min, x_max = self.ax.get_xlim()
+        if not self.raw_line.get_xdata().size and len(self.x) > 0:
+            x_min, x_max = self.x[0], self.x[-1]  # Not scaled to data yet
+        num_bins = max(int(self.ax.get_window_extent().width), 1)
+
+        def view(values, mask=None):
+            return decimate(self.x, values, x_min, x_max, num_bins, mask)
+
+        self.raw_line.set_data(*view(self.y))
+        self.threshold_line.set_data(*view(threshold))
+        self.clearsky_scatter.set_offsets(
+            np.column_stack(view(self.y, clearsky_mask)))
+        self.linear_scatter.set_offsets(
+            np.column_stack(view(self.y, linear_mask)))
+        self.both_scatter.set_offsets(
+            np.column_stack(view(self.y, linear_mask & clearsky_mask)))
+
+    def on_xlim_changed(self, ax):
+        self.render_view()
+        self.canvas.draw_idle()
+
+    def closeEvent(self, event):
+        # Drop pending jobs and let the running one finish before closing.
+        self.debounce_timer.stop()
+        self.closing = True
+        self.job_id += 1
+        self.pool.clear()
+        self.pool.waitForDone()
+        self.precompute_pool.waitForDone()
+        if self.profiler is not None:
+            self.profiler.disable()
+        super().closeEvent(event)
 
 # Example code for debug
 if __name__ == "__main__":
     import synthetic_data_generation as sdg
     import anomaly_detection as ad
+    from linear_fit import rolling_linear_residual_std
+    from decimation import decimate
+    from profiling import Profiler, stage
     ghi = sdg.SyntheticIrradiance()
     ghi.add_sensor_disconnect()
     ghi.add_noise()
@@ -0,0 +1,203 @@
+""" Anomaly masks as sorted start/stop arrays.
+
+Anomalies are rare and come in runs, so a year of minute masks usually
+holds a few hundred intervals: AnomalyIntervals stores them as two int64
+arrays of sample positions, and its set operations work on the interval
+boundaries only.
+
+    intervals = AnomalyIntervals.from_mask(linear_mask)
+    flagged = intervals | AnomalyIntervals.from_mask(clearsky_mask)
+    flagged.overlapping("2025-03-01 10:00", "2025-03-01 12:00").to_frame()
+"""
+import numpy as np
+import pandas as pd
+
+
+class AnomalyIntervals:
+    """
+    Disjoint, sorted half-open intervals [start, stop) of sample positions.
+
+    Intervals are normalized: sorted, non-empty, and neither overlapping
+    nor touching (touching runs are merged), so the same mask always gives
+    the same arrays.
+
+    Args:
+        starts, stops: int arrays of positions, stops exclusive.
+        length: Number of samples of the mask.
+        times: Optional pandas.DatetimeIndex of the samples, to query and
+            report intervals by timestamp.
+    """
+
+    def __init__(self, starts, stops, length: int, times=None):
+        starts = np.asarray(starts, dtype=np.int64)
+        stops = np.asarray(stops, dtype=np.int64)
+        if starts.shape != stops.shape:
+            raise ValueError("starts and stops must have the same length.")
+        if times is not None and len(times) != length:
+            raise ValueError("times must have length samples.")
+        self.starts, self.stops = _normalize(np.clip(starts, 0, length),
+                                             np.clip(stops, 0, length))
+        self.length = length
+        self.times = times
+
+    @classmethod
+    def from_mask(cls, mask, times=None):
+        """
+        Intervals of the True runs of a boolean array or Series (whose
+        index is used as times when it is a DatetimeIndex).
+        """
+        if times is None and isinstance(getattr(mask, "index", None),
+                                        pd.DatetimeIndex):
+            times = mask.index
+        mask = np.asarray(mask, dtype=bool)
+        edges = np.flatnonzero(np.diff(mask, prepend=False, append=False))
+        return cls(edges[::2], edges[1::2], len(mask), times)
+
+    def to_mask(self) -> np.ndarray:
+        # Marks +1 at starts and -1 at stops, the running sum is the mask.
+        marks = np.zeros(self.length + 1, dtype=np.int8)
+        marks[self.starts] = 1
+        marks[self.stops] -= 1
+        return np.cumsum(marks[:-1]) > 0
+
+    def to_series(self) -> pd.Series:
+        return pd.Series(self.to_mask(), index=self.times)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns:
+            frame: pandas.DataFrame with the start and (exclusive) stop
+                positions and the samples of each interval, plus its
+                first and last timestamps when times are known.
+        """
+        frame = pd.DataFrame({"start": self.starts,
+                              "stop": self.stops,
+                              "samples": self.stops - self.starts})
+        if self.times is not None:
+            frame["first_time"] = self.times[self.starts]
+            frame["last_time"] = self.times[self.stops - 1]
+        return frame
+
+    def __len__(self):
+        # Number of intervals.
+        return len(self.starts)
+
+    def count(self) -> int:
+        # Number of flagged samples.
+        return int((self.stops - self.starts).sum())
+
+    @property
+    def nbytes(self) -> int:
+        return self.starts.nbytes + self.stops.nbytes
+
+    def __eq__(self, other):
+        return (isinstance(other, AnomalyIntervals)
+                and self.length == other.length
+                and np.array_equal(self.starts, other.starts)
+                and np.array_equal(self.stops, other.stops))
+
+    def __repr__(self):
+        return (f"AnomalyIntervals({len(self)} intervals, "
+                f"{self.count()} of {self.length} samples)")
+
+    def __or__(self, other):
+        self._check_other(other)
+        return self._replace(*_coverage_at_least(
+            [self.starts, other.starts], [self.stops, other.stops], 1))
+
+    def __and__(self, other):
+        self._check_other(other)
+        return self._replace(*_coverage_at_least(
+            [self.starts, other.starts], [self.stops, other.stops], 2))
+
+    def __invert__(self):
+        # Gaps between the intervals, and before the first or after the
+        # last one.
+        boundaries = np.concatenate(([0], np.column_stack(
+            (self.starts, self.stops)).ravel(), [self.length]))
+        return self._replace(boundaries[::2], boundaries[1::2])
+
+    def __sub__(self, other):
+        return self & ~other
+
+    def shift(self, offset: int):
+        # Moves every interval by offset samples, clipped to the mask.
+        return self._replace(self.starts + offset, self.stops + offset)
+
+    def dilate(self, before: int = 0, after: int = 0):
+        # Extends each interval by before samples to the left and after
+        # samples to the right, merging the intervals that meet.
+        return self._replace(self.starts - before, self.stops + after)
+
+    def backfill(self, horizon: int):
+        """
+        Interval form of linear_fit.backfill_window: every flagged sample
+        also flags the sample horizon positions before it.
+        """
+        return self | self.shift(-horizon)
+
+    def overlapping(self, t0, t1):
+        """
+        Intervals with at least one sample between t0 and t1 (inclusive),
+        found by binary search. t0 and t1 are sample positions, or
+        timestamps when times are known.
+        """
+        first, last = self._positions(t0, t1)
+        begin = np.searchsorted(self.stops, first, side="right")
+        end = np.searchsorted(self.starts, last, side="left")
+        return AnomalyIntervals(self.starts[begin:end], self.stops[begin:end],
+                                self.length, self.times)
+
+    def _positions(self, t0, t1):
+        # Half-open position range [first, last) of the samples in [t0, t1].
+        if all(isinstance(t, (int, np.integer)) for t in (t0, t1)):
+            return t0, t1 + 1
+        if self.times is None:
+            raise ValueError("Timestamps need the times of the samples.")
+        first = self.times.searchsorted(self._timestamp(t0), side="left")
+        last = self.times.searchsorted(self._timestamp(t1), side="right")
+        return first, last
+
+    def _timestamp(self, value):
+        # Naive timestamps are taken in the timezone of times.
+        timestamp = pd.Timestamp(value)
+        if timestamp.tz is None and self.times.tz is not None:
+            timestamp = timestamp.tz_localize(self.times.tz)
+        return timestamp
+
+    def _replace(self, starts, stops):
+        return AnomalyIntervals(starts, stops, self.length, self.times)
+
+    def _check_other(self, other):
+        if self.length != other.length:
+            raise ValueError("Intervals must cover the same samples.")
+
+
+def _normalize(starts, stops):
+    # Sorts the intervals and merges the ones that overlap or touch.
+    keep = starts < stops
+    starts, stops = starts[keep], stops[keep]
+    if not len(starts):
+        return starts, stops
+    order = np.argsort(starts, kind="stable")
+    starts, stops = starts[order], stops[order]
+    reach = np.maximum.accumulate(stops)
+    is_new = np.empty(len(starts), dtype=bool)
+    is_new[0] = True
+    is_new[1:] = starts[1:] > reach[:-1]
+    is_last = np.append(is_new[1:], True)
+    return starts[is_new], reach[is_last]
+
+
+def _coverage_at_least(starts, stops, level):
+    # Intervals where at least level of the interval sets overlap, from
+    # a running count over the sorted boundaries.
+    positions = np.concatenate(starts + stops)
+    deltas = np.concatenate([np.ones(len(s), dtype=np.int64) for s in starts]
+                            + [-np.ones(len(s), dtype=np.int64)
+                               for s in stops])
+    positions, inverse = np.unique(positions, return_inverse=True)
+    coverage = np.cumsum(np.bincount(inverse, weights=deltas,
+                                     minlength=len(positions)))
+    is_covered = coverage[:-1] >= level
+    return positions[:-1][is_covered], positions[1:][is_covered]
@@ -0,0 +1,132 @@
+import numpy as np
+
+
+def rolling_linear_residual_std(values,
+                                horizon: int,
+                                engine: str = "cumsum",
+                                block_size: int = 4096) -> np.ndarray:
+    """
+    Standard deviation of the residuals of a least-squares linear fit over
+    a rolling window, computed for every window at once.
+
+    Equivalent to running np.polyfit(t, window, 1) and np.std(residuals) on
+    each window of Series.rolling(horizon), but without a Python call per
+    sample.
+
+    Args:
+        values: 1-D array-like of samples, or 2-D with one column per
+            sensor (all columns are processed together, along axis 0).
+        horizon: Number of samples in each window (at least 2).
+        engine: "cumsum" uses window sums from cumulative sums, O(n).
+            "strided" evaluates the same sums on a strided window view,
+            O(n * horizon), and serves as a reference implementation.
+        block_size: Number of windows per cumulative-sum block. The sums are
+            restarted for each block to keep rounding errors bounded on
+            long series.
+
+    Returns:
+        residual_std: float array aligned with the right edge of each window,
+            with the shape of values. The first horizon - 1 values, and
+            windows containing NaN, are NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim not in (1, 2):
+        raise ValueError("values must be a 1-D or 2-D array.")
+    if horizon < 2:
+        raise ValueError("horizon must be at least 2 samples.")
+
+    residual_std = np.full(values.shape, np.nan)
+    if len(values) < horizon:
+        return residual_std
+
+    if engine == "cumsum":
+        window_std = _residual_std_cumsum(values, horizon, block_size)
+    elif engine == "strided":
+        window_std = _residual_std_strided(values, horizon)
+    else:
+        raise ValueError(f"Unknown engine '{engine}'. "
+                         "Use 'cumsum' or 'strided'.")
+
+    residual_std[horizon - 1:] = window_std
+    return residual_std
+
+
+def backfill_window(mask: np.ndarray, horizon: int) -> np.ndarray:
+    """
+    Vectorized form of the back-fill step of anomaly_linear.
+
+    A flag at the right edge of a window (index k) is copied to index
+    k - horizon, exactly as the original per-element loop did:
+        for k in range(horizon, len(mask)):
+            if mask[k]:
+                mask[k - horizon] = True
+    2-D masks are filled along axis 0, one column per sensor.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    filled = mask.copy()
+    if horizon < len(mask):
+        filled[:len(mask) - horizon] |= mask[horizon:]
+    return filled
+
+
+def _window_residual_variance(sum_y, sum_yy, sum_ty, horizon):
+    # Least-squares residual variance from window sums, with t centered
+    # on the window (so the slope and intercept terms decouple):
+    #   var = (Syy - Sy^2 / w - Sty^2 / Stt) / w
+    sum_tt = horizon * (horizon**2 - 1) / 12
+    variance = (sum_yy - sum_y**2 / horizon - sum_ty**2 / sum_tt) / horizon
+    return np.maximum(variance, 0)
+
+
+def _residual_std_cumsum(values, horizon, block_size):
+    num_windows = len(values) - horizon + 1
+    t_center = (horizon - 1) / 2
+    # Columns (sensors) are processed together, with t along axis 0:
+    columns = values.shape[1:]
+    shape = (-1,) + (1,) * len(columns)
+    zero = np.zeros((1,) + columns)
+
+    # Windows containing NaN are invalid, as in Series.rolling():
+    is_nan = np.isnan(values)
+    nan_count = np.concatenate((zero, np.cumsum(is_nan, axis=0)))
+    has_nan = (nan_count[horizon:] - nan_count[:-horizon]) > 0
+    values = np.where(is_nan, 0.0, values)
+
+    window_std = np.empty((num_windows,) + columns)
+    for first in range(0, num_windows, block_size):
+        last = min(first + block_size, num_windows)
+        segment = values[first:last + horizon - 1]
+
+        # Residuals don't depend on an offset in y, so center the block:
+        segment = segment - segment.mean(axis=0)
+        t = np.arange(len(segment)).reshape(shape)
+
+        cum_y = np.concatenate((zero, np.cumsum(segment, axis=0)))
+        cum_yy = np.concatenate((zero, np.cumsum(segment**2, axis=0)))
+        cum_ty = np.concatenate((zero, np.cumsum(t * segment, axis=0)))
+
+        start = np.arange(last - first).reshape(shape)
+        sum_y = cum_y[horizon:] - cum_y[:-horizon]
+        sum_yy = cum_yy[horizon:] - cum_yy[:-horizon]
+        # sum((t - start - t_center) * y) over each window:
+        sum_ty = (cum_ty[horizon:] - cum_ty[:-horizon]
+                  - (start + t_center) * sum_y)
+
+        window_std[first:last] = np.sqrt(
+            _window_residual_variance(sum_y, sum_yy, sum_ty, horizon))
+
+    window_std[has_nan] = np.nan
+    return window_std
+
+
+def _residual_std_strided(values, horizon):
+    # Windows along axis 0, on the last axis of the view:
+    windows = np.lib.stride_tricks.sliding_window_view(values, horizon,
+                                                       axis=0)
+    t = np.arange(horizon) - (horizon - 1) / 2
+
+    sum_y = windows.sum(axis=-1)
+    sum_yy = np.einsum("...k,...k->...", windows, windows)
+    sum_ty = windows @ t
+
+    return np.sqrt(_window_residual_variance(sum_y, sum_yy, sum_ty, horizon))
@@ -2,14 +2,377 @@
 # import pandas as pd
 # import matplotlib.pyplot as plt
 
+import os
+import json
+import numpy as np
 import pandas as pd
 
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATASET_FORMAT_VERSION = 1
+
+
 def load_dataset(filepath):
     """Loads dataset from a CSV file into a Pandas DataFrame."""
     return pd.read_csv(filepath)
 
+
+def parse_timestamps(values, tz: str, format: str = TIMESTAMP_FORMAT,
+                     ambiguous="infer") -> pd.DatetimeIndex:
+    """
+    Parses timestamp strings into a timezone aware DatetimeIndex.
+
+    Args:
+        values: Sequence of timestamp strings.
+        tz: Timezone of the site, e.g. "America/Santiago".
+        format: strftime format of naive local timestamps. Timestamps with a
+            UTC offset (as written by DataFrame.to_csv for a timezone aware
+            index) are detected and converted instead.
+        ambiguous: Passed to DatetimeIndex.tz_localize() for naive local
+            timestamps repeated when daylight saving time ends. "infer"
+            works for sorted data that contains the whole repeated hour.
+    """
+    values = pd.Index(values)
+    sample = str(values[0]) if len(values) > 0 else ""
+    if sample[-6:-5] in ("+", "-") and sample[-3:-2] == ":":
+        times = pd.to_datetime(values, format="ISO8601", utc=True)
+        return pd.DatetimeIndex(times).tz_convert(tz)
+
+    times = pd.to_datetime(values, format=format)
+    return pd.DatetimeIndex(times).tz_localize(tz, ambiguous=ambiguous)
+
+
+def count_ambiguous_tail(values, tz: str,
+                         format: str = TIMESTAMP_FORMAT) -> int:
+    """
+    Number of rows at the end of values that are naive local timestamps in
+    the hour repeated when daylight saving time ends.
+
+    ambiguous="infer" needs the whole repeated hour, so readers of a file in
+    blocks hold these rows back and parse them with the next block.
+    """
+    values = pd.Index(values)
+    sample = str(values[0]) if len(values) > 0 else ""
+    if sample[-6:-5] in ("+", "-") and sample[-3:-2] == ":":
+        return 0  # UTC offsets are never ambiguous
+    # Unparseable timestamps are left to parse_timestamps to report:
+    times = pd.DatetimeIndex(pd.to_datetime(values, format=format,
+                                            errors="coerce"))
+    localized = times.tz_localize(tz, ambiguous="NaT",
+                                  nonexistent="shift_forward")
+    is_ambiguous = np.asarray(localized.isna() & ~times.isna())
+    # Position of the last unambiguous row, counted from the end:
+    reversed_ambiguous = is_ambiguous[::-1]
+    if reversed_ambiguous.all():
+        return len(values)
+    return int(np.argmin(reversed_ambiguous))
+
+
+def read_dataset_chunks(filepath, tz: str, chunksize: int = 100_000,
+                        timestamp_column: str = "Timestamp",
+                        format: str = TIMESTAMP_FORMAT,
+                        numeric: bool = True):
+    """
+    Reads a CSV dataset in chunks of chunksize rows.
+
+    Rows of a repeated hour (end of daylight saving time) at the end of a
+    chunk are carried over to the next one, so the hour is always localized
+    as a whole and chunks may hold a few more or fewer rows than chunksize.
+
+    Yields:
+        pandas.DataFrame indexed by a timezone aware DatetimeIndex (see
+        parse_timestamps). With numeric=True every column is cast to float64.
+    """
+    reader = pd.read_csv(filepath,
+                         chunksize=chunksize,
+                         dtype={timestamp_column: str})
+    carried = None
+    for chunk in reader:
+        if carried is not None:
+            chunk = pd.concat([carried, chunk])
+            carried = None
+        held = count_ambiguous_tail(chunk[timestamp_column], tz, format)
+        if held:
+            carried = chunk.iloc[len(chunk) - held:]
+            chunk = chunk.iloc[:len(chunk) - held]
+            if chunk.empty:
+                continue
+        yield _parse_chunk(chunk, tz, timestamp_column, format, numeric)
+    if carried is not None:
+        yield _parse_chunk(carried, tz, timestamp_column, format, numeric)
+
+
+def _parse_chunk(chunk, tz, timestamp_column, format, numeric):
+    chunk = chunk.copy()
+    times = parse_timestamps(chunk.pop(timestamp_column), tz, format)
+    if numeric:
+        chunk = chunk.astype(float)
+    chunk.index = times.rename(timestamp_column)
+    return chunk
+
+
+def save_dataset(dataset_dir: str, data, masks: dict = None,
+                 dtype: str = "float32", source: dict = None):
+    """
+    Stores a time series in a binary dataset directory:
+        meta.json   - timezone, column names, dtypes and source file info
+        times.npy   - int64 nanoseconds since epoch (UTC), sorted
+        values.npy  - 2-D array of values, one column per series
+        masks.npy   - optional 2-D boolean array, one column per mask
+
+    Every array can be opened memory-mapped, see open_dataset().
+
+    Args:
+        dataset_dir: Directory to write (created if needed).
+        data: pandas.Series or DataFrame with a timezone aware DatetimeIndex.
+        masks: Optional dict of name -> boolean array aligned with data.
+        dtype: Storage dtype of the values, float32 halves the size.
+        source: Optional description of the file the data came from.
+    """
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    if frame.index.tz is None:
+        raise ValueError("DatetimeIndex must be timezone-aware.")
+    if not frame.index.is_monotonic_increasing:
+        frame = frame.sort_index()
+
+    # meta.json is written last: a dataset without it is incomplete.
+    os.makedirs(dataset_dir, exist_ok=True)
+    meta_path = os.path.join(dataset_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    np.save(os.path.join(dataset_dir, "times.npy"),
+            frame.index.as_unit("ns").asi8)
+    np.save(os.path.join(dataset_dir, "values.npy"),
+            frame.to_numpy(dtype=dtype))
+
+    mask_names = list(masks) if masks else []
+    if mask_names:
+        np.save(os.path.join(dataset_dir, "masks.npy"),
+                np.column_stack([np.asarray(masks[name], dtype=bool)
+                                 for name in mask_names]))
+
+    _write_meta(dataset_dir, frame.index, frame.columns, dtype, mask_names,
+                source)
+
+
+class DatasetWriter:
+    """
+    Writes a dataset (see save_dataset) block by block, for data that
+    doesn't fit in memory. The timestamps are known up front, the values and
+    masks are preallocated memory-mapped arrays filled by write().
+
+    meta.json is only written by close(), so an interrupted write leaves an
+    incomplete dataset that open_dataset() refuses to open.
+
+        with DatasetWriter(dataset_dir, times, ["GHI"], ["outlier_mask"]) as w:
+            for row, values, masks in blocks:
+                w.write(row, values, [masks])
+
+    Args:
+        dataset_dir: Directory to write (created if needed).
+        times: Timezone aware, sorted DatetimeIndex of the whole dataset.
+        columns: Names of the value columns.
+        mask_names: Names of the mask columns.
+        dtype: Storage dtype of the values.
+        source: Optional description of where the data came from.
+    """
+
+    def __init__(self, dataset_dir: str, times: pd.DatetimeIndex,
+                 columns: list, mask_names: list = (),
+                 dtype: str = "float32", source: dict = None):
+        if times.tz is None:
+            raise ValueError("DatetimeIndex must be timezone-aware.")
+        if not times.is_monotonic_increasing:
+            raise ValueError("DatetimeIndex must be sorted.")
+
+        self.dataset_dir = dataset_dir
+        self.times = times
+        self.columns = list(columns)
+        self.mask_names = list(mask_names)
+        self.dtype = dtype
+        self.source = source
+
+        os.makedirs(dataset_dir, exist_ok=True)
+        meta_path = os.path.join(dataset_dir, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        np.save(os.path.join(dataset_dir, "times.npy"),
+                times.as_unit("ns").asi8)
+        self.values = np.lib.format.open_memmap(
+            os.path.join(dataset_dir, "values.npy"), mode="w+",
+            dtype=dtype, shape=(len(times), len(self.columns)))
+        self.masks = None
+        if self.mask_names:
+            self.masks = np.lib.format.open_memmap(
+                os.path.join(dataset_dir, "masks.npy"), mode="w+",
+                dtype=bool, shape=(len(times), len(self.mask_names)))
+
+    def write(self, row: int, values, masks: list = None):
+        """
+        Stores a block of rows starting at position row.
+
+        Args:
+            row: Position of the first row of the block.
+            values: 1-D array (single column) or 2-D array of values.
+            masks: Optional list of boolean arrays, one per mask name.
+        """
+        values = np.asarray(values)
+        values = values.reshape(len(values), -1)
+        self.values[row:row + len(values)] = values
+        if masks:
+            self.masks[row:row + len(values)] = np.column_stack(masks)
+
+    def close(self):
+        # Flush the arrays, then mark the dataset as complete.
+        self.values.flush()
+        if self.masks is not None:
+            self.masks.flush()
+        self.values = self.masks = None
+        _write_meta(self.dataset_dir, self.times, self.columns, self.dtype,
+                    self.mask_names, self.source)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+def _write_meta(dataset_dir, index, columns, dtype, mask_names, source):
+    meta = {"version": DATASET_FORMAT_VERSION,
+            "tz": str(index.tz),
+            "index_name": index.name,
+            "columns": [str(column) for column in columns],
+            "dtype": str(np.dtype(dtype)),
+            "masks": list(mask_names),
+            "source": source}
+    with open(os.path.join(dataset_dir, "meta.json"), "w") as file:
+        json.dump(meta, file, indent=2)
+
+
+def ingest_dataset(filepath, dataset_dir: str, tz: str,
+                   chunksize: int = 1_000_000, dtype: str = "float32",
+                   format: str = TIMESTAMP_FORMAT):
+    """
+    Parses a CSV dataset once (explicit timestamp format, tz localization)
+    and stores it with save_dataset(). Columns ending in "_mask" or
+    containing booleans are stored as masks.
+    """
+    chunks = list(read_dataset_chunks(filepath, tz, chunksize,
+                                      format=format, numeric=False))
+    frame = pd.concat(chunks) if chunks else pd.DataFrame()
+    is_mask = [column.endswith("_mask") or frame[column].dtype == bool
+               for column in frame.columns]
+    mask_columns = [c for c, mask in zip(frame.columns, is_mask) if mask]
+    value_columns = [c for c, mask in zip(frame.columns, is_mask) if not mask]
+
+    stat = os.stat(filepath)
+    save_dataset(dataset_dir,
+                 frame[value_columns].astype(float),
+                 {column: frame[column].astype(bool) for column in mask_columns},
+                 dtype=dtype,
+                 source={"path": os.path.abspath(filepath),
+                         "size": stat.st_size,
+                         "mtime": stat.st_mtime})
+
+
+def open_dataset(dataset_dir: str, start=None, end=None,
+                 masks: bool = False):
+    """
+    Opens a dataset written by save_dataset() without copying it.
+
+    The arrays are memory-mapped, so only the rows between start and end
+    (inclusive, found with a binary search on the timestamps) are read
+    from disk.
+
+    Args:
+        dataset_dir: Dataset directory.
+        start, end: Optional bounds, as timestamps or strings in the
+            dataset timezone.
+        masks: Also return the stored masks.
+
+    Returns:
+        data: pandas.DataFrame of values with a timezone aware index.
+        mask_frame: pandas.DataFrame of boolean masks (only if masks=True).
+    """
+    with open(os.path.join(dataset_dir, "meta.json")) as file:
+        meta = json.load(file)
+    times = np.load(os.path.join(dataset_dir, "times.npy"), mmap_mode="r")
+
+    rows = slice(_search_time(times, start, meta["tz"], "left"),
+                 _search_time(times, end, meta["tz"], "right"))
+    index = pd.DatetimeIndex(times[rows].view("datetime64[ns]"), tz="UTC")
+    index = index.tz_convert(meta["tz"]).rename(meta["index_name"])
+
+    values = np.load(os.path.join(dataset_dir, "values.npy"), mmap_mode="r")
+    data = pd.DataFrame(values[rows], index=index, columns=meta["columns"],
+                        copy=False)
+    if not masks:
+        return data
+
+    if meta["masks"]:
+        stored = np.load(os.path.join(dataset_dir, "masks.npy"), mmap_mode="r")
+        mask_frame = pd.DataFrame(stored[rows], index=index,
+                                  columns=meta["masks"], copy=False)
+    else:
+        mask_frame = pd.DataFrame(index=index)
+    return data, mask_frame
+
+
+def load_dataset_cached(filepath, tz: str, dataset_dir: str = None,
+                        start=None, end=None, dtype: str = "float32"):
+    """
+    Loads a CSV dataset through its binary copy: the CSV is ingested on the
+    first call (or when it changed) and later calls only open the
+    memory-mapped arrays.
+
+    Args:
+        filepath: CSV file with a "Timestamp" column.
+        tz: Timezone of the naive timestamps in the file.
+        dataset_dir: Binary dataset directory. Defaults to the CSV path with
+            a "_binary" suffix instead of the extension.
+        start, end: Optional bounds of the rows to load.
+        dtype: Storage dtype of the values.
+
+    Returns:
+        data: pandas.DataFrame of values with a timezone aware index.
+        mask_frame: pandas.DataFrame with the mask columns of the file.
+    """
+    if dataset_dir is None:
+        dataset_dir = os.path.splitext(filepath)[0] + "_binary"
+    if not _is_up_to_date(dataset_dir, filepath, tz, dtype):
+        ingest_dataset(filepath, dataset_dir, tz, dtype=dtype)
+    return open_dataset(dataset_dir, start, end, masks=True)
+
+
+def _is_up_to_date(dataset_dir, filepath, tz, dtype):
+    try:
+        with open(os.path.join(dataset_dir, "meta.json")) as file:
+            meta = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return False
+    stat = os.stat(filepath)
+    source = meta.get("source") or {}
+    return (meta.get("version") == DATASET_FORMAT_VERSION
+            and meta.get("tz") == tz
+            and meta.get("dtype") == str(np.dtype(dtype))
+            and source.get("size") == stat.st_size
+            and source.get("mtime") == stat.st_mtime)
+
+
+def _search_time(times, bound, tz, side):
+    # Position of bound in the sorted int64 timestamps.
+    if bound is None:
+        return 0 if side == "left" else len(times)
+    bound = pd.Timestamp(bound)
+    bound = bound.tz_localize(tz) if bound.tz is None else bound
+    return int(np.searchsorted(times, bound.as_unit("ns").value, side=side))
+
+
 if __name__ == "__main__":
-    
+
     print("\n\n\n\n\n")
 
     df = load_dataset("data/private/private_data_raw.csv")
@@ -0,0 +1,212 @@
+""" Low-memory mode for multi-site, decade-long runs.
+
+detect_compact() runs the clearsky and linear detectors block by block on
+float32 values (e.g. the memory-mapped values of load_data.open_dataset),
+with the solar geometry computed per block and the masks stored as bits
+(PackedMask). Its scratch memory depends on block_size, not on the length
+of the series, while the usual path holds several full-length float64
+arrays (clearsky components, thresholds, residual std).
+
+peak_rss_report() measures the peak RSS of both paths on the same
+synthetic data.
+"""
+import resource
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pvlib
+
+if __name__ == "__main__":
+    from utils import validate_pvlib_location, validate_timezone_aware
+    from anomaly_detection import (DetectionContext, anomaly_clearsky,
+                                   anomaly_linear, get_night_mask,
+                                   get_clearsky_interpolated)
+    from linear_fit import rolling_linear_residual_std
+    from synthetic_data_generation import SyntheticPlan, default_location
+else:
+    from . utils import validate_pvlib_location, validate_timezone_aware
+    from . anomaly_detection import (DetectionContext, anomaly_clearsky,
+                                     anomaly_linear, get_night_mask,
+                                     get_clearsky_interpolated)
+    from . linear_fit import rolling_linear_residual_std
+    from . synthetic_data_generation import SyntheticPlan, default_location
+
+
+DEFAULT_BLOCK_SIZE = 2 ** 18
+
+# Number of set bits of every byte value:
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis],
+                          axis=1).sum(axis=1)
+
+
+class PackedMask:
+    """
+    Boolean mask stored as bits, 8 times smaller than a bool array.
+
+    Args:
+        bits: uint8 array from np.packbits (big bit order).
+        length: Number of samples of the mask.
+    """
+
+    def __init__(self, bits: np.ndarray, length: int):
+        self.bits = bits
+        self.length = length
+
+    @classmethod
+    def zeros(cls, length: int):
+        return cls(np.zeros(-(-length // 8), dtype=np.uint8), length)
+
+    @classmethod
+    def from_bool(cls, mask):
+        mask = np.asarray(mask, dtype=bool)
+        return cls(np.packbits(mask), len(mask))
+
+    def to_bool(self, start: int = 0, stop: int = None) -> np.ndarray:
+        # Unpacks the samples start:stop only.
+        stop = self.length if stop is None else min(stop, self.length)
+        bits = self.bits[start // 8:-(-stop // 8)]
+        offset = start % 8
+        return np.unpackbits(bits, count=offset + stop - start)[offset:] > 0
+
+    def set_block(self, start: int, mask: np.ndarray):
+        # Stores mask at start, which must be a multiple of 8.
+        if start % 8:
+            raise ValueError("Blocks must start at a multiple of 8.")
+        packed = np.packbits(np.asarray(mask, dtype=bool))
+        self.bits[start // 8:start // 8 + len(packed)] = packed
+
+    def count(self) -> int:
+        return int(_POPCOUNT[self.bits].sum())
+
+    def __len__(self):
+        return self.length
+
+    def __or__(self, other):
+        return PackedMask(self.bits | other.bits, self.length)
+
+    def __and__(self, other):
+        return PackedMask(self.bits & other.bits, self.length)
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+
+def detect_compact(values,
+                   times: pd.DatetimeIndex,
+                   location: pvlib.location.Location,
+                   irradiance_type: str = "ghi",
+                   day_margin: float = 1.25,
+                   night_threshold: float = 10,
+                   horizon: int = 120,
+                   tolerance: float = 1,
+                   min_irradiance: float = 10,
+                   clearsky_step: str = None,
+                   block_size: int = DEFAULT_BLOCK_SIZE):
+    """
+    Low-memory equivalent of anomaly_clearsky and anomaly_linear.
+
+    The series is processed in blocks of block_size samples. Each block
+    computes its own night mask and clearsky component (float32) and its
+    rolling fit, reading horizon - 1 samples before the block and horizon
+    after it, so the masks are the same as the full-length detectors.
+    Thresholds are computed in place in one scratch array per block.
+
+    Args:
+        values: 1-D array of irradiance (float32 is kept as is).
+        times: timezone aware pandas.DatetimeIndex of values.
+        location: pvlib.location.Location of the site.
+        irradiance_type, day_margin, night_threshold: As in
+            anomaly_clearsky.
+        horizon, tolerance, min_irradiance: As in anomaly_linear.
+        clearsky_step: Optional coarse grid spacing to interpolate the
+            clearsky model (see get_clearsky_interpolated).
+        block_size: Samples per block, rounded up to a multiple of 8.
+
+    Returns:
+        clearsky_mask: PackedMask of clearsky outliers.
+        linear_mask: PackedMask of linear anomalies.
+    """
+    # Check input validity:
+    validate_pvlib_location(location)
+    validate_timezone_aware(times)
+    if len(values) != len(times):
+        raise ValueError("values and times must have the same length.")
+
+    num_samples = len(values)
+    block_size = -(-block_size // 8) * 8
+    clearsky_mask = PackedMask.zeros(num_samples)
+    linear_mask = PackedMask.zeros(num_samples)
+
+    for first in range(0, num_samples, block_size):
+        last = min(first + block_size, num_samples)
+        block = np.asarray(values[first:last])
+        block_times = times[first:last]
+        is_night = get_night_mask(block_times, location)
+
+        # Clearsky rule, thresholds built in place in a float32 array:
+        if clearsky_step is None:
+            components = location.get_clearsky(block_times, model="ineichen")
+        else:
+            components, _ = get_clearsky_interpolated(location, block_times,
+                                                      step=clearsky_step)
+        clearsky = components[irradiance_type].to_numpy(dtype=np.float32)
+        del components
+        threshold = np.multiply(clearsky, np.float32(day_margin))
+        clearsky += np.float32(50)
+        np.maximum(threshold, clearsky, out=threshold)
+        del clearsky
+        threshold[is_night] = night_threshold
+        clearsky_mask.set_block(first, block > threshold)
+        del threshold
+
+        # Linear rule: windows ending in the block and horizon after it,
+        # for the back-fill.
+        start = max(first - horizon + 1, 0)
+        stop = min(last + horizon, num_samples)
+        residual_std = rolling_linear_residual_std(
+            np.asarray(values[start:stop], dtype=float), horizon)
+        is_linear = residual_std[first - start:] <= tolerance
+        del residual_std
+        is_flagged = is_linear[:last - first].copy()
+        is_flagged[:len(is_linear) - horizon] |= is_linear[horizon:]
+        is_flagged &= block >= min_irradiance
+        is_flagged &= ~is_night
+        linear_mask.set_block(first, is_flagged)
+
+    return clearsky_mask, linear_mask
+
+
+def peak_rss_report(days: float = 365, seed: int = 0) -> dict:
+    """
+    Peak RSS in MB of the detectors on days of synthetic minute data, each
+    measured in a fresh process: "data" only renders the data (float32),
+    "standard" runs anomaly_clearsky and anomaly_linear on a float64 Series
+    with a DetectionContext, and "compact" runs detect_compact().
+    """
+    context = multiprocessing.get_context("spawn")
+    report = {}
+    for mode in ["data", "standard", "compact"]:
+        with context.Pool(1) as pool:
+            report[mode] = pool.apply(_peak_rss, (mode, days, seed))
+    return report
+
+
+def _peak_rss(mode, days, seed):
+    location = default_location()
+    times = pd.date_range("2025-01-01", periods=int(days * 1440),
+                          freq="min", tz=location.tz)
+    plan = SyntheticPlan(seed=seed).sensor_disconnect().noise().outliers()
+    values, _, _ = plan.render(times, location, clearsky_step="15min",
+                               dtype=np.float32)
+    values = values.to_numpy()
+
+    if mode == "standard":
+        series = pd.Series(values.astype(float), index=times)
+        context = DetectionContext(times, location)
+        anomaly_clearsky(series, location, "ghi", context=context)
+        anomaly_linear(series, location, context=context)
+    elif mode == "compact":
+        detect_compact(values, times, location)
+    # ru_maxrss is in kilobytes on Linux:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
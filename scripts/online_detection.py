@@ -0,0 +1,276 @@
+import math
+import numpy as np
+import pandas as pd
+import pvlib
+
+if __name__ == "__main__":
+    from utils import validate_pvlib_location
+    from anomaly_detection import NS_PER_DAY, get_sunrise_sunset_table
+else:
+    from . utils import validate_pvlib_location
+    from . anomaly_detection import NS_PER_DAY, get_sunrise_sunset_table
+
+
+# Flags returned by OnlineDetector.update(), combined with |:
+CEILING = 1
+CLEARSKY = 2
+LINEAR = 4
+
+# Days kept in a shared day_cache, oldest dropped first:
+MAX_CACHED_DAYS = 366
+
+
+class OnlineDetector:
+    """
+    Streaming version of anomaly_ceiling, anomaly_clearsky and
+    anomaly_linear, for samples arriving one at a time.
+
+    A ring buffer holds the last horizon samples with the sums of the linear
+    fit (sum y, sum y^2, sum t*y), updated in O(1) per sample and rebuilt
+    from the buffer every horizon samples to keep rounding errors bounded.
+    Sunrise, sunset and the clearsky curve are computed once per (UTC) day,
+    so a sample only costs a few float operations.
+
+    update() returns the flags known when the sample arrives. The linear
+    rule also flags the sample horizon positions before a linear window
+    (the back-fill of anomaly_linear); those late flags are appended to
+    self.corrections as (timestamp in ns, LINEAR). Flags plus corrections
+    are the same masks as the batch detectors on the same samples.
+
+    Args:
+        location: pvlib.location.Location of the sensor.
+        irradiance_type: Clearsky component to compare to ('ghi', 'dni',
+            'dhi').
+        horizon, tolerance, min_irradiance: Parameters of anomaly_linear.
+        day_margin, night_threshold: Parameters of anomaly_clearsky.
+        max_value: Optional anomaly_ceiling threshold.
+        tz: Timezone of the batch series to match (the clearsky turbidity
+            depends on the local day of year). Defaults to location.tz.
+        clearsky_step: Spacing of the daily clearsky grid, interpolated
+            linearly between points, dividing one day evenly. Use the
+            sampling period to get the exact model values.
+        day_cache: Optional dict shared by detectors, so sensors of the
+            same site compute each day's features only once.
+    """
+
+    def __init__(self,
+                 location: pvlib.location.Location,
+                 irradiance_type: str = "ghi",
+                 horizon: int = 120,
+                 tolerance: float = 1,
+                 min_irradiance: float = 10,
+                 day_margin: float = 1.25,
+                 night_threshold: float = 10,
+                 max_value: float = None,
+                 tz: str = None,
+                 clearsky_step: str = "1min",
+                 day_cache: dict = None):
+        # Check input validity:
+        validate_pvlib_location(location)
+        if horizon < 2:
+            raise ValueError("horizon must be at least 2 samples.")
+
+        self.location = location
+        self.irradiance_type = irradiance_type
+        self.horizon = horizon
+        self.tolerance = tolerance
+        self.min_irradiance = min_irradiance
+        self.day_margin = day_margin
+        self.night_threshold = night_threshold
+        self.max_value = max_value
+        self.tz = tz or location.tz
+        self.step_ns = pd.Timedelta(clearsky_step).value
+        if self.step_ns <= 0 or NS_PER_DAY % self.step_ns:
+            # The daily grid must end on the next midnight for the
+            # interpolation of the last interval.
+            raise ValueError("clearsky_step must divide one day evenly.")
+        self.day_cache = day_cache
+        self.corrections = []
+
+        # Ring buffer of the last horizon samples, by position % horizon:
+        self._values = [0.0] * horizon
+        self._times = [0] * horizon
+        self._is_linear = [False] * horizon
+        self._is_relevant = [False] * horizon
+        self._count = 0
+        self._last_time = None
+
+        # Sums of the samples in the buffer (minus _offset), with t the
+        # position in the window, oldest first:
+        self._offset = 0.0
+        self._sum_y = 0.0
+        self._sum_yy = 0.0
+        self._sum_ty = 0.0
+        self._num_nan = 0
+        self._sum_tt = horizon * (horizon**2 - 1) / 12
+        self._t_center = (horizon - 1) / 2
+
+        # Features of the current UTC day:
+        self._day = None
+        self._sunrise = None
+        self._sunset = None
+        self._clearsky = None
+
+    def update(self, timestamp, value: float) -> int:
+        """
+        Processes one sample.
+
+        Args:
+            timestamp: Time of the sample, as int nanoseconds since epoch
+                (UTC) or anything pandas.Timestamp accepts (timezone aware).
+            value: Irradiance, NaN for a missing sample.
+
+        Returns:
+            flags: CEILING | CLEARSKY | LINEAR bits known so far.
+        """
+        if isinstance(timestamp, (int, np.integer)):
+            t = int(timestamp)
+        else:
+            t = pd.Timestamp(timestamp).value
+        if self._last_time is not None and t <= self._last_time:
+            raise ValueError("Samples must arrive in increasing time order.")
+        self._last_time = t
+
+        day = t // NS_PER_DAY
+        if day != self._day:
+            self._load_day(day)
+
+        # Night and clearsky rules, as in anomaly_clearsky:
+        is_night = ((self._sunrise is not None and t < self._sunrise)
+                    or (self._sunset is not None and t > self._sunset))
+        flags = 0
+        if is_night:
+            if value > self.night_threshold:
+                flags = CLEARSKY
+        else:
+            position, remainder = divmod(t - day * NS_PER_DAY, self.step_ns)
+            clearsky = self._clearsky[position]
+            if remainder:
+                following = self._clearsky[position + 1]
+                clearsky += (following - clearsky) * remainder / self.step_ns
+            if value > max(clearsky * self.day_margin, clearsky + 50):
+                flags = CLEARSKY
+        if self.max_value is not None and value > self.max_value:
+            flags |= CEILING
+
+        # Linear rule on the window ending at this sample:
+        is_linear = self._push(value)
+        is_relevant = not is_night and value >= self.min_irradiance
+
+        # Back-fill: a linear window flags the sample horizon positions
+        # back, which is the slot about to be overwritten.
+        slot = self._count % self.horizon
+        if (is_linear and self._count >= self.horizon
+                and not self._is_linear[slot] and self._is_relevant[slot]):
+            self.corrections.append((self._times[slot], LINEAR))
+
+        self._values[slot] = value
+        self._times[slot] = t
+        self._is_linear[slot] = is_linear
+        self._is_relevant[slot] = is_relevant
+        self._count += 1
+
+        if self._count % self.horizon == 0:
+            self._resync()
+        if is_linear and is_relevant:
+            flags |= LINEAR
+        return flags
+
+    def pop_corrections(self) -> list:
+        # Returns and forgets the corrections emitted so far.
+        corrections, self.corrections = self.corrections, []
+        return corrections
+
+    def process(self, timeseries: pd.Series) -> pd.DataFrame:
+        """
+        Feeds a whole series through update() and applies the corrections.
+
+        Returns:
+            masks: pandas.DataFrame with ceiling, clearsky_outlier and
+                linear_anomaly columns, indexed like timeseries.
+        """
+        times = timeseries.index.as_unit("ns").asi8
+        flags = np.array([self.update(t, value) for t, value
+                          in zip(times.tolist(), timeseries.tolist())],
+                         dtype=np.int64)
+        for t, flag in self.pop_corrections():
+            flags[np.searchsorted(times, t)] |= flag
+        return pd.DataFrame({"ceiling": (flags & CEILING) > 0,
+                             "clearsky_outlier": (flags & CLEARSKY) > 0,
+                             "linear_anomaly": (flags & LINEAR) > 0},
+                            index=timeseries.index)
+
+    def _push(self, value):
+        # Adds value to the window sums, and tells whether the full window
+        # ending at it has a residual std within tolerance.
+        horizon = self.horizon
+        is_nan = value != value
+        z = 0.0 if is_nan else value - self._offset
+        self._num_nan += is_nan
+
+        if self._count < horizon:
+            self._sum_ty += self._count * z
+            self._sum_y += z
+            self._sum_yy += z * z
+            if self._count < horizon - 1:
+                return False
+        else:
+            old = self._values[self._count % horizon]
+            if old != old:
+                self._num_nan -= 1
+                old = 0.0
+            else:
+                old -= self._offset
+            # Remaining samples move one position back:
+            self._sum_ty += (horizon - 1) * z - (self._sum_y - old)
+            self._sum_y += z - old
+            self._sum_yy += z * z - old * old
+
+        if self._num_nan:
+            return False
+        sum_ty = self._sum_ty - self._t_center * self._sum_y
+        variance = (self._sum_yy - self._sum_y**2 / horizon
+                    - sum_ty**2 / self._sum_tt) / horizon
+        return math.sqrt(max(variance, 0.0)) <= self.tolerance
+
+    def _resync(self):
+        # Rebuilds the sums from the (full) buffer, centered on its mean.
+        start = self._count % self.horizon  # Oldest sample
+        window = self._values[start:] + self._values[:start]
+        valid = [value for value in window if value == value]
+        self._offset = sum(valid) / len(valid) if valid else 0.0
+        centered = [value - self._offset if value == value else 0.0
+                    for value in window]
+        self._sum_y = sum(centered)
+        self._sum_yy = sum(z * z for z in centered)
+        self._sum_ty = sum(t * z for t, z in enumerate(centered))
+        self._num_nan = len(window) - len(valid)
+
+    def _load_day(self, day):
+        key = (self.location.latitude, self.location.longitude,
+               self.location.altitude, self.tz, self.step_ns,
+               self.irradiance_type, day)
+        if self.day_cache is not None and key in self.day_cache:
+            self._sunrise, self._sunset, self._clearsky = self.day_cache[key]
+            self._day = day
+            return
+
+        # Sunrise, sunset and clearsky grid of a UTC day (plus the first
+        # point of the next one, for interpolation).
+        start = pd.Timestamp(day * NS_PER_DAY, tz="UTC").tz_convert(self.tz)
+        _, table = get_sunrise_sunset_table(pd.DatetimeIndex([start]),
+                                            self.location)
+        sunrise, sunset = table["sunrise"].iloc[0], table["sunset"].iloc[0]
+        self._sunrise = None if pd.isna(sunrise) else pd.Timestamp(sunrise).value
+        self._sunset = None if pd.isna(sunset) else pd.Timestamp(sunset).value
+
+        grid = pd.date_range(start, periods=NS_PER_DAY // self.step_ns + 1,
+                             freq=pd.Timedelta(self.step_ns, "ns"))
+        clearsky = self.location.get_clearsky(grid, model="ineichen")
+        self._clearsky = clearsky[self.irradiance_type].tolist()
+        self._day = day
+
+        if self.day_cache is not None:
+            if len(self.day_cache) >= MAX_CACHED_DAYS:
+                self.day_cache.pop(next(iter(self.day_cache)))  # Oldest
+            self.day_cache[key] = (self._sunrise, self._sunset, self._clearsky)
@@ -0,0 +1,165 @@
+""" Stage-level profiling of the detection pipeline.
+
+The detectors and the GUI mark their stages (SPA sunrise/sunset, clearsky
+model, rolling fit, back-fill, plotting...) with profiled() or stage().
+While no Profiler is enabled these cost one global lookup, so they stay in
+the code:
+
+    with Profiler(memory=True) as profiler:
+        anomaly_linear(series, location)
+    print(profiler.report())
+"""
+import time
+import functools
+import threading
+import contextlib
+import tracemalloc
+import pandas as pd
+
+# Profiler receiving the stages, None while profiling is disabled:
+_active = None
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def stage(name: str, rows: int = None):
+    """
+    Context manager recording a stage in the enabled Profiler, if any.
+
+    Args:
+        name: Stage name, e.g. "anomaly_linear.rolling_fit".
+        rows: Number of rows the stage processes.
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name, rows)
+
+
+def profiled(name: str):
+    """
+    Decorator recording each call as a stage. Rows are the length of the
+    first argument (e.g. the timeseries or the index).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+            rows = len(args[0]) if args and hasattr(args[0], "__len__") else None
+            with _active.stage(name, rows):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Profiler:
+    """
+    Collects the wall time, rows and memory of every stage run while it is
+    enabled (as a context manager, or with enable() and disable()). Only one
+    profiler is enabled at a time.
+
+    Args:
+        memory: Also trace allocations with tracemalloc, which slows the
+            stages down. Each record then has the peak memory allocated
+            during the stage and the memory still held after it.
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()  # Stack of open stages per thread
+        self._started_tracing = False
+
+    def enable(self):
+        global _active
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        _active = self
+        return self
+
+    def disable(self):
+        global _active
+        if _active is self:
+            _active = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disable()
+
+    def clear(self):
+        with self._lock:
+            self.records = []
+
+    def mark(self) -> int:
+        # Position to pass as since= to only report later records.
+        return len(self.records)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, rows: int = None):
+        stack = self._local.__dict__.setdefault("stack", [])
+        memory = self.memory and tracemalloc.is_tracing()
+        if memory:
+            # The enclosing stage keeps the peak seen so far, since
+            # reset_peak() starts a new one for this stage.
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            stack.append([current, current])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            record = {"name": name, "seconds": seconds, "rows": rows,
+                      "peak_bytes": None, "net_bytes": None,
+                      "thread": threading.current_thread().name}
+            if memory:
+                current, peak = tracemalloc.get_traced_memory()
+                start_bytes, running_peak = stack.pop()
+                peak = max(peak, running_peak)
+                if stack:
+                    stack[-1][1] = max(stack[-1][1], peak)
+                record["peak_bytes"] = peak - start_bytes
+                record["net_bytes"] = current - start_bytes
+            with self._lock:
+                self.records.append(record)
+
+    def report(self, since: int = 0) -> pd.DataFrame:
+        """
+        Returns:
+            report: pandas.DataFrame with one row per stage name, in order
+                of first appearance: calls, total and mean seconds, rows,
+                rows per second, and the largest peak and net memory in MB.
+        """
+        columns = ["calls", "seconds", "mean_seconds", "rows",
+                   "rows_per_second", "peak_mb", "net_mb"]
+        records = pd.DataFrame(self.records[since:],
+                               columns=["name", "seconds", "rows",
+                                        "peak_bytes", "net_bytes", "thread"])
+        if records.empty:
+            return pd.DataFrame(columns=columns).rename_axis("stage")
+
+        stages = records.groupby("name", sort=False)
+        report = pd.DataFrame({
+            "calls": stages.size(),
+            "seconds": stages["seconds"].sum(),
+            "mean_seconds": stages["seconds"].mean(),
+            "rows": stages["rows"].sum(min_count=1),
+            "peak_mb": stages["peak_bytes"].max() / 2**20,
+            "net_mb": stages["net_bytes"].max() / 2**20,
+        })
+        report["rows_per_second"] = report["rows"] / report["seconds"]
+        return report[columns].rename_axis("stage")
+
+    def summary(self, since: int = 0) -> str:
+        # One line of total milliseconds per stage, e.g. for a status bar.
+        report = self.report(since)
+        return " | ".join(f"{name} {seconds * 1000:.0f} ms"
+                          for name, seconds in report["seconds"].items())
@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import pvlib
+
+if __name__ == "__main__":
+    from utils import validate_pvlib_location, validate_timezone_aware
+    from anomaly_detection import (NS_PER_DAY, DetectionContext,
+                                   anomaly_clearsky, anomaly_linear)
+    from solar_cache import NpyStore
+    from profiling import stage
+else:
+    from . utils import validate_pvlib_location, validate_timezone_aware
+    from . anomaly_detection import (NS_PER_DAY, DetectionContext,
+                                     anomaly_clearsky, anomaly_linear)
+    from . solar_cache import NpyStore
+    from . profiling import stage
+
+
+RESULT_CACHE_FORMAT_VERSION = 1
+DEFAULT_RESULT_CACHE_DIR = os.environ.get(
+    "RESULT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "detection_results"))
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of detector masks, by (UTC) day blocks.
+
+    Each block's mask is stored under a hash of the block's timestamps and
+    values, the location and the detector parameters. The linear mask of a
+    block also depends on the horizon - 1 samples before it and the
+    horizon samples after it (rolling fit and back-fill), which are part of
+    its hash. On a re-run only the blocks whose hash changed are computed,
+    on the block plus that overlap, and every other block is read from disk:
+    appending a day to an archive recomputes that day and the day before
+    it, changing the tolerance recomputes the linear masks only.
+
+    Blocks are kept in an NpyStore (atomic writes, LRU eviction), like the
+    arrays of SolarCache.
+
+    Args:
+        cache_dir: Directory for the cache files. Defaults to the
+            RESULT_CACHE_DIR environment variable or
+            ~/.cache/detection_results.
+        max_bytes: Size limit of the cache directory.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = 2**30):
+        self.cache_dir = cache_dir or DEFAULT_RESULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.store = NpyStore(self.cache_dir, max_bytes)
+        self.stats = {}
+
+    def detect(self,
+               timeseries: pd.Series,
+               location: pvlib.location.Location,
+               irradiance_type: str = "ghi",
+               day_margin: float = 1.25,
+               night_threshold: float = 10,
+               horizon: int = 120,
+               tolerance: float = 1,
+               min_irradiance: float = 10,
+               clearsky_model: str = "ineichen"):
+        """
+        Cached equivalent of anomaly_clearsky and anomaly_linear on the
+        whole timeseries (same masks). self.stats then holds the number of
+        blocks and of blocks computed by each detector.
+
+        Returns:
+            clearsky_mask: pandas.Series of clearsky outliers.
+            linear_mask: pandas.Series of linear anomalies.
+        """
+        # Check input validity:
+        validate_pvlib_location(location)
+        validate_timezone_aware(timeseries.index)
+        if not timeseries.index.is_monotonic_increasing:
+            raise ValueError("timeseries must be sorted by time.")
+
+        times = timeseries.index
+        values = np.ascontiguousarray(timeseries.to_numpy(dtype=float))
+        ns = np.ascontiguousarray(times.as_unit("ns").asi8)
+        starts, stops = _day_blocks(ns)
+        with stage("result_cache.hash", len(values)):
+            digests = [_digest(ns[start:stop], values[start:stop])
+                       for start, stop in zip(starts, stops)]
+
+        spec = {"location": [location.latitude, location.longitude,
+                             location.altitude, str(location.tz)],
+                "irradiance_type": irradiance_type}
+        clearsky_spec = {**spec, "kind": "clearsky_mask",
+                         "model": clearsky_model,
+                         "day_margin": day_margin,
+                         "night_threshold": night_threshold}
+        linear_spec = {**spec, "kind": "linear_mask",
+                       "horizon": horizon,
+                       "tolerance": tolerance,
+                       "min_irradiance": min_irradiance}
+        clearsky_keys = [self._block_key(clearsky_spec, digest)
+                         for digest in digests]
+        linear_keys = [self._block_key(
+            linear_spec, digest,
+            _digest(values[max(start - horizon + 1, 0):start]),
+            _digest(values[stop:stop + horizon]))
+            for digest, start, stop in zip(digests, starts, stops)]
+
+        def compute_clearsky(first, last):
+            context = DetectionContext(times[first:last], location,
+                                       clearsky_model)
+            mask, _ = anomaly_clearsky(timeseries.iloc[first:last], location,
+                                       irradiance_type, day_margin,
+                                       night_threshold, context=context)
+            return mask.to_numpy()
+
+        def compute_linear(first, last):
+            # Windows ending in the blocks, and horizon after for the
+            # back-fill:
+            start = max(first - horizon + 1, 0)
+            stop = min(last + horizon, len(values))
+            mask = anomaly_linear(timeseries.iloc[start:stop], location,
+                                  horizon, tolerance, min_irradiance)
+            return mask.to_numpy()[first - start:last - start]
+
+        clearsky_mask, clearsky_computed = self._masks(
+            clearsky_keys, starts, stops, compute_clearsky)
+        linear_mask, linear_computed = self._masks(
+            linear_keys, starts, stops, compute_linear)
+        self.store.evict()
+
+        self.stats = {"blocks": len(starts),
+                      "clearsky_computed": clearsky_computed,
+                      "linear_computed": linear_computed}
+        return (pd.Series(clearsky_mask, index=times, name=timeseries.name),
+                pd.Series(linear_mask, index=times, name=timeseries.name))
+
+    def _masks(self, keys, starts, stops, compute):
+        # Reads the cached blocks, then computes the missing ones by runs of
+        # consecutive blocks and stores them.
+        mask = np.zeros(stops[-1] if len(stops) else 0, dtype=bool)
+        missing = []
+        with stage("result_cache.load", len(mask)):
+            for block, key in enumerate(keys):
+                values = self.store.load(key)
+                if values is None:
+                    missing.append(block)
+                else:
+                    mask[starts[block]:stops[block]] = values
+
+        for run in np.split(missing, np.flatnonzero(np.diff(missing) > 1) + 1):
+            if not len(run):
+                continue
+            first, last = starts[run[0]], stops[run[-1]]
+            with stage("result_cache.compute", last - first):
+                mask[first:last] = compute(first, last)
+            for block in run:
+                self.store.save(keys[block], mask[starts[block]:stops[block]])
+        return mask, len(missing)
+
+    def size(self) -> int:
+        """ Total size in bytes of the cached blocks. """
+        return self.store.size()
+
+    def clear(self):
+        """ Removes every block of the cache. """
+        self.store.clear()
+
+    def _block_key(self, spec, *digests):
+        text = json.dumps({"version": RESULT_CACHE_FORMAT_VERSION,
+                           "pvlib": pvlib.__version__,
+                           "spec": spec,
+                           "data": digests}, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _day_blocks(ns):
+    # Start and stop positions of the runs of samples of each UTC day.
+    days = ns // NS_PER_DAY
+    starts = np.flatnonzero(np.diff(days, prepend=days[:1] - 1))
+    stops = np.append(starts[1:], len(ns))
+    return starts, stops
+
+
+def _digest(*arrays):
+    # Hash of the bytes of the arrays, blake2b being faster than sha256
+    # on the raw data.
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+
+def rolling_median_mad(values,
+                       window: int,
+                       engine: str = "partition",
+                       block_size: int = None):
+    """
+    Median and median absolute deviation (MAD) of a rolling window.
+
+    The median comes from Series.rolling(window).median(), which keeps the
+    window in a skiplist in C, O(n log window). The "partition" engine then
+    takes the distances of each window to its median on a strided window
+    view, block by block, and selects their middle with np.partition, an
+    O(window) selection per window instead of a sort.
+
+    Args:
+        values: 1-D array-like of samples. NaN samples are skipped.
+        window: Number of samples in each window.
+        engine: "partition" (above) or "strided", which takes np.nanmedian
+            of a strided window view for both statistics, as a reference.
+        block_size: Number of windows per block of the strided views.
+            Defaults to about 2**18 samples per block.
+
+    Returns:
+        median, mad: float arrays aligned with the right edge of each
+            window. The first window - 1 values, and windows without any
+            valid sample, are NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim != 1:
+        raise ValueError("values must be a 1-D array.")
+    if window < 1:
+        raise ValueError("window must be at least 1 sample.")
+
+    median = np.full(len(values), np.nan)
+    mad = np.full(len(values), np.nan)
+    if len(values) < window:
+        return median, mad
+    block_size = block_size or max(2**18 // window, 1)
+
+    if engine == "partition":
+        window_median = pd.Series(values).rolling(
+            window, min_periods=1).median().to_numpy()[window - 1:]
+        window_mad = _mad_partition(values, window_median, window,
+                                    block_size)
+    elif engine == "strided":
+        window_median, window_mad = _median_mad_strided(values, window,
+                                                        block_size)
+    else:
+        raise ValueError(f"Unknown engine '{engine}'. "
+                         "Use 'partition' or 'strided'.")
+
+    median[window - 1:] = window_median
+    mad[window - 1:] = window_mad
+    return median, mad
+
+
+def _mad_partition(values, window_median, window, block_size):
+    windows = np.lib.stride_tricks.sliding_window_view(values, window)
+    valid_count = np.concatenate(([0], np.cumsum(~np.isnan(values))))
+    count = valid_count[window:] - valid_count[:-window]
+    middle = window // 2
+    window_mad = np.full(len(windows), np.nan)
+
+    for first in range(0, len(windows), block_size):
+        last = min(first + block_size, len(windows))
+        block_count = count[first:last]
+        deviation = np.abs(windows[first:last]
+                           - window_median[first:last, np.newaxis])
+        partial = np.flatnonzero(block_count < window)
+        if len(partial):
+            # A window of count valid samples gets window // 2 - count // 2
+            # of its NaN set below every distance and the others above, so
+            # its middle valid distances sit at the middle of the row.
+            rows = deviation[partial]
+            is_nan = np.isnan(rows)
+            num_below = middle - block_count[partial] // 2
+            is_below = is_nan & (np.cumsum(is_nan, axis=1)
+                                 <= num_below[:, np.newaxis])
+            rows[is_nan] = np.inf
+            rows[is_below] = -1
+            deviation[partial] = rows
+
+        deviation.partition(middle, axis=1)
+        mad = deviation[:, middle]
+        even = np.flatnonzero((block_count % 2 == 0) & (block_count > 0))
+        if len(even):
+            # The lower middle is the largest distance left of the upper:
+            lower = deviation[even, :middle].max(axis=1)
+            mad[even] = (lower + mad[even]) / 2
+        mad[block_count == 0] = np.nan
+        window_mad[first:last] = mad
+    return window_mad
+
+
+def _median_mad_strided(values, window, block_size):
+    num_windows = len(values) - window + 1
+    windows = np.lib.stride_tricks.sliding_window_view(values, window)
+    window_median = np.full(num_windows, np.nan)
+    window_mad = np.full(num_windows, np.nan)
+    is_valid = ~np.isnan(values)
+    valid_count = np.concatenate(([0], np.cumsum(is_valid)))
+    has_valid = (valid_count[window:] - valid_count[:-window]) > 0
+
+    # Blocks bound the memory of the window copies made by nanmedian:
+    for first in range(0, num_windows, block_size):
+        last = min(first + block_size, num_windows)
+        rows = np.flatnonzero(has_valid[first:last]) + first
+        block = windows[rows]
+        median = np.nanmedian(block, axis=1)
+        window_median[rows] = median
+        window_mad[rows] = np.nanmedian(np.abs(block - median[:, np.newaxis]),
+                                        axis=1)
+    return window_median, window_mad
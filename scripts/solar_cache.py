@@ -0,0 +1,240 @@
+import os
+import json
+import tempfile
+import hashlib
+import numpy as np
+import pandas as pd
+import pvlib
+
+if __name__ == "__main__":
+    from utils import validate_pvlib_location, validate_timezone_aware
+    from anomaly_detection import get_clearsky_interpolated
+else:
+    from . utils import validate_pvlib_location, validate_timezone_aware
+    from . anomaly_detection import get_clearsky_interpolated
+
+
+CACHE_FORMAT_VERSION = 1
+CLEARSKY_COLUMNS = ["ghi", "dni", "dhi"]
+DEFAULT_CACHE_DIR = os.environ.get(
+    "SOLAR_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "solar_geometry"))
+
+
+class SolarCache:
+    """
+    Persistent on-disk cache for solar geometry arrays (clearsky components,
+    night masks) of a fixed site and period.
+
+    Each entry is a single .npy file named after a hash of the location
+    (latitude, longitude, altitude, tz), the model, the kind of array and the
+    timestamp index. Entries are opened memory-mapped, and stored in an
+    NpyStore: written atomically so several processes can share the
+    directory, and evicted least recently used first once the directory
+    grows beyond max_bytes.
+
+    Args:
+        cache_dir: Directory for the cache files. Defaults to the
+            SOLAR_CACHE_DIR environment variable or ~/.cache/solar_geometry.
+        max_bytes: Size limit of the cache directory.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = 2**30):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.store = NpyStore(self.cache_dir, max_bytes)
+
+    def get_clearsky(self,
+                     location: pvlib.location.Location,
+                     times: pd.DatetimeIndex,
+                     model: str = "ineichen") -> pd.DataFrame:
+        """ Cached equivalent of location.get_clearsky(times, model=model). """
+        def compute():
+            components = location.get_clearsky(times, model=model)
+            return components[CLEARSKY_COLUMNS].to_numpy(dtype=float)
+
+        values = self.get_array("clearsky", location, times, compute, model)
+        return pd.DataFrame(values, index=times, columns=CLEARSKY_COLUMNS)
+
+    def get_clearsky_interpolated(self,
+                                  location: pvlib.location.Location,
+                                  times: pd.DatetimeIndex,
+                                  model: str = "ineichen",
+                                  step: str = "15min"):
+        """
+        Cached equivalent of anomaly_detection.get_clearsky_interpolated().
+        """
+        def compute():
+            components, max_error = get_clearsky_interpolated(
+                location, times, model, step)
+            # The error estimate is stored as an extra last row.
+            values = components[CLEARSKY_COLUMNS].to_numpy(dtype=float)
+            return np.vstack([values, max_error[CLEARSKY_COLUMNS]])
+
+        values = self.get_array("clearsky", location, times, compute,
+                                f"{model}@{pd.Timedelta(step)}")
+        components = pd.DataFrame(values[:-1],
+                                  index=times,
+                                  columns=CLEARSKY_COLUMNS)
+        max_error = pd.Series(values[-1], index=CLEARSKY_COLUMNS)
+        return components, max_error
+
+    def get_array(self,
+                  kind: str,
+                  location: pvlib.location.Location,
+                  times: pd.DatetimeIndex,
+                  compute,
+                  model: str = None) -> np.ndarray:
+        """
+        Returns the cached array for (kind, location, times, model), or calls
+        compute() and stores its result.
+
+        Args:
+            kind: Name of the quantity, e.g. "night_mask".
+            location: pvlib.location.Location of the site.
+            times: timezone aware pandas.DatetimeIndex.
+            compute: Function without arguments returning the array.
+            model: Optional model name that changes the result.
+
+        Returns:
+            A read-only numpy array, memory-mapped when read from the cache.
+        """
+        # Check input validity:
+        validate_pvlib_location(location)
+        validate_timezone_aware(times)
+
+        key = self.key(kind, location, times, model)
+        values = self.store.load(key, mmap_mode="r")
+        if values is not None:
+            return values
+
+        # The computed array is returned as is: another process may evict
+        # the entry before it could be read back.
+        values = np.asarray(compute()).view()
+        values.flags.writeable = False
+        self.store.save(key, values)
+        self.store.evict()
+        return values
+
+    def key(self,
+            kind: str,
+            location: pvlib.location.Location,
+            times: pd.DatetimeIndex,
+            model: str = None) -> str:
+        """ Hash identifying an entry of the cache. """
+        spec = {
+            "version": CACHE_FORMAT_VERSION,
+            "pvlib": pvlib.__version__,
+            "kind": kind,
+            "model": model,
+            "location": [location.latitude, location.longitude,
+                         location.altitude, str(location.tz)],
+            "times": _index_spec(times),
+        }
+        text = json.dumps(spec, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def size(self) -> int:
+        """ Total size in bytes of the cached entries. """
+        return self.store.size()
+
+    def clear(self):
+        """ Removes every entry of the cache. """
+        self.store.clear()
+
+
+class NpyStore:
+    """
+    Directory of .npy entries named by a key. Entries are written
+    atomically so several processes can share the directory, and evicted
+    least recently used first by evict() once the directory grows beyond
+    max_bytes.
+
+    Args:
+        cache_dir: Directory of the entries (created if needed).
+        max_bytes: Size limit of the directory.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def load(self, key: str, mmap_mode: str = None):
+        # The stored array (marked as recently used), or None.
+        path = self.path(key)
+        try:
+            values = np.load(path, mmap_mode=mmap_mode)
+            os.utime(path)
+            return values
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+    def save(self, key: str, values: np.ndarray):
+        self._write(self.path(key), values)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def size(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            _remove(path)
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits max_bytes.
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries[:-1]:  # Always keep the newest entry
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def _write(self, path, values):
+        # Write to a private temporary file (unique across processes and
+        # threads), then rename: readers see either no entry or a complete
+        # one.
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp",
+                                        prefix=os.path.basename(path) + ".",
+                                        dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                np.save(file, values)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by another process
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+
+def _index_spec(times: pd.DatetimeIndex):
+    # Regular indexes are identified by start, length and frequency. Others
+    # by a hash of their timestamps.
+    spec = {"tz": str(times.tz), "length": len(times)}
+    if times.freq is not None and len(times) > 0:
+        spec["start"] = int(times[:1].as_unit("ns").asi8[0])
+        spec["freq"] = times.freqstr
+    else:
+        ns = np.ascontiguousarray(times.as_unit("ns").asi8)
+        spec["sha256"] = hashlib.sha256(ns.tobytes()).hexdigest()
+    return spec
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass  # Removed by another process
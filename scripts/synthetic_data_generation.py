@@ -1,25 +1,52 @@
+import copy
 import numpy as np
 import pandas as pd
 import pvlib
 
 if __name__ == "__main__":
     from utils import validate_pvlib_location, validate_timezone_aware
+    from load_data import DatasetWriter
 else:
     from . utils import validate_pvlib_location, validate_timezone_aware
+    from . load_data import DatasetWriter
+
+
+# Samples per block of random draws in SyntheticPlan:
+PLAN_BLOCK_SIZE = 2 ** 16
+
+
+def default_times() -> pd.DatetimeIndex:
+    # One week of minute data, the default period of SyntheticIrradiance.
+    return pd.date_range(start="2025-03-01",
+                         end="2025-03-07",
+                         freq="min",
+                         tz="America/Santiago")
+
+
+def default_location() -> pvlib.location.Location:
+    # Default site of SyntheticIrradiance.
+    return pvlib.location.Location(latitude=-41.13941227780086,
+                                   longitude=-73.02542294598776,
+                                   tz="America/Santiago",
+                                   name="Frutillar")
+
 
 class SyntheticIrradiance:
 
     def __init__(
             self,
-            times = pd.date_range(start="2025-03-01",
-                                  end="2025-03-07",
-                                  freq="min",
-                                  tz="America/Santiago"),
-            location = pvlib.location.Location(latitude=-41.13941227780086,
-                                               longitude=-73.02542294598776,
-                                               tz="America/Santiago",
-                                               name="Frutillar"),
-            irradiance_type = "ghi"):
+            times = None,
+            location = None,
+            irradiance_type = "ghi",
+            cache = None,
+            clearsky_step = None,
+            seed = None):
+
+        # Defaults are built per instance, not at import time:
+        if times is None:
+            times = default_times()
+        if location is None:
+            location = default_location()
         
         # Check input validity:
         validate_pvlib_location(location)
@@ -29,16 +56,28 @@ class SyntheticIrradiance:
         self.times = times
         self.location = location
         self.irradiance_type = irradiance_type
+        self.cache = cache  # Optional solar_cache.SolarCache
+        self.clearsky_step = clearsky_step  # e.g. "15min" to interpolate
+        self.clearsky_error = None
+
+        # Every random draw comes from this generator, so the same seed
+        # (int, SeedSequence or Generator) gives the same series:
+        self.rng = np.random.default_rng(seed)
 
         # Initialize series and anomaly masks:
-        self.series = pd.Series(np.zeros(len(times)), index=times)
+        self.values = np.zeros(len(times))
+        self.series = pd.Series(self.values, index=times, copy=False)
         self.add_clearsky()
 
-        self.outlier_mask = np.zeros_like(self.series, dtype=bool)
-        self.malfunction_mask = np.zeros_like(self.series, dtype=bool)
+        self.outlier_mask = np.zeros(len(times), dtype=bool)
+        self.malfunction_mask = np.zeros(len(times), dtype=bool)
 
         """ The purpose of self.series is to provide
             easy access to the finished build of the timeseries.
+            It wraps the self.values array, which every method
+            updates in place instead of copying the series, so
+            self.series always shows the latest build. The add_*
+            methods return a copy: the build at that step.
 
             For extended use, the class provides the components:
             - self.clearsky - Through the add_clearsky method
@@ -54,97 +93,445 @@ class SyntheticIrradiance:
         # Define the clearsky component and update
 
         # pvlib's get_clearsky returns a dataframe of ghi, dni, dhi
-        components = self.location.get_clearsky(self.times, model="ineichen")
+        components, self.clearsky_error = _clearsky(self.location,
+                                                    self.times,
+                                                    self.cache,
+                                                    self.clearsky_step)
         self.clearsky = components[self.irradiance_type]
 
-        self.series = self.series + self.clearsky
+        self.values += self.clearsky.to_numpy()
         return self.clearsky
                                          
     def add_noise(self, noise_level=0.001):
         std = noise_level * np.max(self.clearsky)
-        rng = np.random.default_rng()
         
         # Define the noise component and update
-        self.noise = rng.normal(loc=0,
-                                scale=std,
-                                size=len(self.times))
-        self.series = self.series + self.noise
-        return self.series
+        self.noise = self.rng.normal(loc=0,
+                                     scale=std,
+                                     size=len(self.times))
+        self.values += self.noise
+        return self.series.copy()
     
     def add_outliers(self, outlier_cap=3.0, outlier_percentage=0.01):
         # Introduce outliers at random positions
-        rng = np.random.default_rng()
         num_outliers = round(outlier_percentage * len(self.series))
-        indices = rng.choice(a=len(self.series), size=num_outliers)
+        indices = self.rng.choice(a=len(self.series), size=num_outliers)
         
         # Prevent outliers from affecting malfunction behavior
         self.outlier_mask[indices] = True
-        self.outlier_mask = self.outlier_mask & ~ self.malfunction_mask
+        self.outlier_mask &= ~ self.malfunction_mask
         
         # Set the irradiance value of the outliers:
-        random_factors = rng.random(self.outlier_mask.sum())
-        candidate_outliers = (np.abs(self.clearsky.loc[self.outlier_mask])
+        positions = np.flatnonzero(self.outlier_mask)
+        random_factors = self.rng.random(len(positions))
+        candidate_outliers = (np.abs(self.clearsky.to_numpy()[positions])
                               * (1.25 + random_factors * (outlier_cap - 1.25)))
         min_outlier_threshold = random_factors * 100 + 50
 
         outlier_values = np.maximum(candidate_outliers, min_outlier_threshold)
         
         # Update the timeseries:
-        self.series.loc[self.outlier_mask] = outlier_values
-        return self.series
+        self.values[positions] = outlier_values
+        return self.series.copy()
 
     def add_sensor_disconnect(self,
                               disconnect_ratio=0.15,
                               num_events=4):
         
         # Introduces continuous linear drift to simulate sensor disconnections
-        fault_duration = round(len(self.series)
-                               * (disconnect_ratio / num_events))
-
-        # Get indices for each event ensuring they are distanced from each other
-        indices = []
-        attempts = 0
-        max_attempts = 15  # Limit to 15 continuous failed attempts.
-        rng = np.random.default_rng()
-
-        while len(indices) < num_events and attempts < max_attempts:
-            candidate = rng.integers(0, len(self.series) - fault_duration)
-            if all(abs(candidate - i) >= 2 * fault_duration for i in indices):
-                indices.append(candidate)
-                attempts = 0
-            else:
-                attempts += 1
-        indices.sort()
+        num_samples = len(self.series)
+        fault_duration = round(num_samples * (disconnect_ratio / num_events))
+
+        # Get indices for each event ensuring they are distanced from each
+        # other by at least 2 * fault_duration:
+        indices = _spaced_positions(self.rng,
+                                    num_samples - fault_duration,
+                                    num_events,
+                                    2 * fault_duration)
         
         # Log warning if we couldn't place all events
         if len(indices) < num_events:
             print("Warning: 'add_sensor_disconnect()'")
             print(f"only placed {len(indices)} out of {num_events} events.")
+        if len(indices) == 0 or fault_duration == 0:
+            return self.series.copy()
 
         # Linear drift (starts from clearsky model)
         # Define max slope as raising irradiance from 0 to max in 12 hours.
         step_time = self.clearsky.index[1] - self.clearsky.index[0]
         num_steps_in_12h = pd.Timedelta(12, "h") / step_time
         max_slope = np.max(self.clearsky)/(num_steps_in_12h)
+        slopes = max_slope * self.rng.random(len(indices))
+
+        # Drift of every event at once, one row per event:
+        steps = np.arange(fault_duration)
+        x = indices[:, np.newaxis] + steps
+        y0 = self.clearsky.to_numpy()[indices]
+        y = slopes[:, np.newaxis] * steps + y0[:, np.newaxis]
+
+        # Update masks
+        self.malfunction_mask[x] = True
+        self.outlier_mask[x] = False
+
+        # Update series
+        self.values[x] = y
+        return self.series.copy()
+
+
+def _spaced_positions(rng, num_positions, num_events, min_distance):
+    """
+    Draws up to num_events sorted positions in range(num_positions) that are
+    at least min_distance apart, without rejection sampling.
+
+    Removing (i * min_distance) from the i-th sorted position leaves any
+    sorted draw from the remaining free range, so the positions are drawn
+    there and spread out again. Fewer events are returned when they can't
+    all fit.
+    """
+    if num_positions <= 0 or num_events <= 0:
+        return np.zeros(0, dtype=int)
+    max_events = (num_positions - 1) // max(min_distance, 1) + 1
+    num_events = min(num_events, max_events)
+    free = num_positions - (num_events - 1) * min_distance
+    offsets = np.sort(rng.integers(0, free, size=num_events))
+    return offsets + np.arange(num_events) * min_distance
+
+
+class SyntheticPlan:
+    """
+    Lazy build plan of a synthetic irradiance series.
+
+    The plan only records its components; nothing is computed until
+    render(), which fills a single preallocated buffer block by block in one
+    pass: clearsky, then every component in the order it was added. Each
+    method returns a new plan, so plans compose without side effects:
+
+        base = SyntheticPlan(seed=0).sensor_disconnect()
+        noisy = base.noise().outliers()
+        series, outlier_mask, malfunction_mask = noisy.render(times, location)
+
+    Random draws are keyed by the plan seed, the component and the block of
+    block_size samples they fall in, and disconnect events are placed once
+    for the whole period. Rendering a sub-window (start, end) therefore
+    gives exactly the same values as slicing the full render, and the same
+    plan can be rendered for other periods or sites.
+
+    Args:
+        seed: Seed of the plan (int or None). Without one a random seed is
+            drawn once, and every render of the plan is still the same.
+        irradiance_type: Clearsky component to use ('ghi', 'dni', 'dhi').
+        block_size: Number of samples per random block.
+    """
+
+    def __init__(self, seed=None, irradiance_type="ghi",
+                 block_size=PLAN_BLOCK_SIZE):
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.irradiance_type = irradiance_type
+        self.block_size = block_size
+        self.components = ()
+
+    def noise(self, noise_level=0.001):
+        # Gaussian noise, see SyntheticIrradiance.add_noise
+        return self._then("noise", noise_level=noise_level)
+
+    def outliers(self, outlier_cap=3.0, outlier_percentage=0.01):
+        # Outliers at random positions, see SyntheticIrradiance.add_outliers
+        return self._then("outliers",
+                          outlier_cap=outlier_cap,
+                          outlier_percentage=outlier_percentage)
+
+    def sensor_disconnect(self, disconnect_ratio=0.15, num_events=4):
+        # Linear drifts, see SyntheticIrradiance.add_sensor_disconnect
+        return self._then("sensor_disconnect",
+                          disconnect_ratio=disconnect_ratio,
+                          num_events=num_events)
+
+    def render(self,
+               times: pd.DatetimeIndex,
+               location: pvlib.location.Location = None,
+               start=None,
+               end=None,
+               cache=None,
+               clearsky_step=None,
+               dtype=np.float64):
+        """
+        Materializes the plan over times, or only over its rows between
+        start and end (inclusive).
+
+        Args:
+            times: Timezone aware DatetimeIndex of the whole period.
+            location: pvlib.location.Location. Defaults to default_location().
+            start, end: Optional bounds of the sub-window to render.
+            cache, clearsky_step: As in SyntheticIrradiance.
+            dtype: dtype of the values, float32 halves their size.
+
+        Returns:
+            series: pandas.Series of irradiance values.
+            outlier_mask: boolean array, True at outliers.
+            malfunction_mask: boolean array, True during sensor disconnects.
+        """
+        validate_timezone_aware(times)
+        first, last = times.slice_locs(start, end)
+        values = np.empty(last - first, dtype=dtype)
+        outlier_mask = np.empty(last - first, dtype=bool)
+        malfunction_mask = np.empty(last - first, dtype=bool)
+
+        self.render_into(values, outlier_mask, malfunction_mask, times,
+                         location, slice(first, last), cache, clearsky_step)
+        series = pd.Series(values, index=times[first:last], copy=False)
+        return series, outlier_mask, malfunction_mask
+
+    def render_into(self,
+                    values: np.ndarray,
+                    outlier_mask: np.ndarray,
+                    malfunction_mask: np.ndarray,
+                    times: pd.DatetimeIndex,
+                    location: pvlib.location.Location = None,
+                    rows: slice = slice(None),
+                    cache=None,
+                    clearsky_step=None):
+        """
+        Renders the rows of times into existing arrays of len(rows), e.g.
+        memory-mapped columns of a load_data.DatasetWriter. Every element
+        of the three arrays is overwritten.
+        """
+        if location is None:
+            location = default_location()
+        validate_pvlib_location(location)
+        first, last, _ = rows.indices(len(times))
+
+        # Decisions that depend on the whole period, made once:
+        names = [name for name, _ in self.components]
+        peak = (_clearsky_peak(location, times, self.irradiance_type)
+                if "noise" in names or "sensor_disconnect" in names else None)
+        events = {number: self._place_events(number, params, times,
+                                             location, peak)
+                  for number, (name, params) in enumerate(self.components)
+                  if name == "sensor_disconnect"}
+
+        size = self.block_size
+        for block_start in range(first - first % size, last, size):
+            # Part of the block inside the rendered rows:
+            lo, hi = max(block_start, first), min(block_start + size, last)
+            piece = slice(lo - first, hi - first)
+            block = {"values": values[piece],
+                     "outlier_mask": outlier_mask[piece],
+                     "malfunction_mask": malfunction_mask[piece],
+                     "offset": lo - block_start,
+                     "length": min(size, len(times) - block_start),
+                     "first": lo}
+
+            components, _ = _clearsky(location, times[lo:hi], cache,
+                                      clearsky_step)
+            block["clearsky"] = components[self.irradiance_type].to_numpy()
+            block["values"][:] = block["clearsky"]
+            block["outlier_mask"][:] = False
+            block["malfunction_mask"][:] = False
+
+            for number, (name, params) in enumerate(self.components):
+                if name == "sensor_disconnect":
+                    _render_disconnect(block, *events[number])
+                    continue
+                rng = self._rng(number, block_start // size)
+                if name == "noise":
+                    _render_noise(block, rng, peak, **params)
+                else:
+                    _render_outliers(block, rng, **params)
+
+    def _then(self, name, **params):
+        plan = copy.copy(self)
+        plan.components = self.components + ((name, params),)
+        return plan
+
+    def _rng(self, *key):
+        # Independent stream for a component (and block) of this plan.
+        sequence = np.random.SeedSequence(self.seed, spawn_key=key)
+        return np.random.default_rng(sequence)
+
+    def _place_events(self, number, params, times, location, peak):
+        # Sensor disconnects of the whole period: starts, slopes, start
+        # values and duration, drawn like add_sensor_disconnect.
+        num_samples = len(times)
+        num_events = params["num_events"]
+        fault_duration = round(num_samples
+                               * (params["disconnect_ratio"] / num_events))
+        rng = self._rng(number)
+        indices = _spaced_positions(rng,
+                                    num_samples - fault_duration,
+                                    num_events,
+                                    2 * fault_duration)
+        if len(indices) < num_events:
+            print("Warning: 'sensor_disconnect()'")
+            print(f"only placed {len(indices)} out of {num_events} events.")
+        if len(indices) == 0 or num_samples < 2:
+            return indices, np.zeros(0), np.zeros(0), 0
+
+        num_steps_in_12h = pd.Timedelta(12, "h") / (times[1] - times[0])
+        slopes = peak / num_steps_in_12h * rng.random(len(indices))
+        y0 = location.get_clearsky(times[indices], model="ineichen")
+        return (indices, slopes, y0[self.irradiance_type].to_numpy(),
+                fault_duration)
+
+
+def _render_noise(block, rng, peak, noise_level):
+    # The whole block is drawn so the noise doesn't depend on the window.
+    noise = rng.normal(loc=0, scale=noise_level * peak, size=block["length"])
+    offset = block["offset"]
+    block["values"] += noise[offset:offset + len(block["values"])]
+
+
+def _render_outliers(block, rng, outlier_cap, outlier_percentage):
+    num_outliers = round(outlier_percentage * block["length"])
+    indices = rng.choice(a=block["length"], size=num_outliers)
+    random_factors = rng.random(num_outliers)
+
+    # Keep the outliers of the window, away from sensor malfunctions:
+    indices = indices - block["offset"]
+    keep = (indices >= 0) & (indices < len(block["values"]))
+    indices, random_factors = indices[keep], random_factors[keep]
+    keep = ~ block["malfunction_mask"][indices]
+    indices, random_factors = indices[keep], random_factors[keep]
+
+    candidate_outliers = (np.abs(block["clearsky"][indices])
+                          * (1.25 + random_factors * (outlier_cap - 1.25)))
+    min_outlier_threshold = random_factors * 100 + 50
+    block["values"][indices] = np.maximum(candidate_outliers,
+                                          min_outlier_threshold)
+    block["outlier_mask"][indices] = True
+
+
+def _render_disconnect(block, indices, slopes, y0, fault_duration):
+    # Events overlapping the block, drifting from their start value:
+    first = block["first"]
+    last = first + len(block["values"])
+    overlapping = np.flatnonzero((indices < last)
+                                 & (indices + fault_duration > first))
+    for event in overlapping:
+        x = np.arange(max(indices[event], first),
+                      min(indices[event] + fault_duration, last))
+        y = slopes[event] * (x - indices[event]) + y0[event]
+        block["values"][x - first] = y
+        block["malfunction_mask"][x - first] = True
+        block["outlier_mask"][x - first] = False
+
+
+def _clearsky(location, times, cache=None, clearsky_step=None):
+    # Clearsky components of times and the interpolation error (or None),
+    # from the cache and/or a coarse grid when given.
+    if clearsky_step is not None:
+        if cache is not None:
+            return cache.get_clearsky_interpolated(location, times,
+                                                   "ineichen", clearsky_step)
+        # Imported here, so the module still runs as a script:
+        from . anomaly_detection import get_clearsky_interpolated
+        return get_clearsky_interpolated(location, times, "ineichen",
+                                         clearsky_step)
+    if cache is not None:
+        return cache.get_clearsky(location, times), None
+    return location.get_clearsky(times, model="ineichen"), None
+
+
+def _clearsky_peak(location, times, irradiance_type):
+    # Maximum of the clearsky model over the days of times, on a fixed
+    # 15 minute grid so it doesn't depend on the rendered window.
+    grid = pd.date_range(times[0].tz_convert("UTC").floor("D"),
+                         times[-1].tz_convert("UTC").ceil("D"),
+                         freq="15min")
+    return location.get_clearsky(grid, model="ineichen")[irradiance_type].max()
+
+
+def write_synthetic_dataset(output_path,
+                            times: pd.DatetimeIndex,
+                            location: pvlib.location.Location = None,
+                            seed: int = None,
+                            chunksize: int = 525_600,
+                            irradiance_type: str = "ghi",
+                            disconnect_ratio: float = 0.15,
+                            num_events: int = 4,
+                            noise_level: float = 0.001,
+                            outlier_percentage: float = 0.01,
+                            masks: bool = True,
+                            clearsky_step=None,
+                            cache=None,
+                            plan: SyntheticPlan = None) -> dict:
+    """
+    Renders a synthetic dataset chunk by chunk and streams it to disk, so
+    memory use depends on chunksize and not on the length of times.
+
+    By default the plan is sensor disconnects, then noise, then outliers,
+    with the given parameters. Since a SyntheticPlan renders any window
+    exactly like the full period, the output only depends on the plan (its
+    seed), not on chunksize.
+
+    Args:
+        output_path: A ".csv" file (naive local timestamps, like the files
+            in data/public) or a binary dataset directory (see
+            load_data.DatasetWriter), rendered in place.
+        times: Timezone aware DatetimeIndex of the whole dataset.
+        location: pvlib.location.Location. Defaults to default_location().
+        seed: Seed of the whole dataset.
+        chunksize: Number of rows rendered at a time.
+        irradiance_type: Clearsky component to generate ('ghi', 'dni',
+            'dhi'), also the upper case column name.
+        disconnect_ratio, num_events: sensor_disconnect parameters for the
+            whole dataset.
+        noise_level: noise parameter.
+        outlier_percentage: outliers parameter.
+        masks: Also write outlier_mask and malfunction_mask.
+        clearsky_step, cache: As in SyntheticIrradiance.
+        plan: SyntheticPlan to render instead of the default one. seed,
+            irradiance_type and the component parameters are then ignored.
+
+    Returns:
+        summary: dict with the number of rows, outliers and malfunctions.
+    """
+    if plan is None:
+        plan = (SyntheticPlan(seed, irradiance_type)
+                .sensor_disconnect(disconnect_ratio, num_events)
+                .noise(noise_level)
+                .outliers(outlier_percentage=outlier_percentage))
+    validate_timezone_aware(times)
+
+    column = plan.irradiance_type.upper()
+    mask_names = ["outlier_mask", "malfunction_mask"] if masks else []
+    is_csv = str(output_path).endswith(".csv")
+    writer = None if is_csv else DatasetWriter(output_path, times, [column],
+                                               mask_names)
 
-        for index in indices:
-            x0 = index
-            y0 = self.clearsky.iloc[index]
+    summary = {"rows": 0, "outliers": 0, "malfunctions": 0}
+    for start in range(0, len(times), chunksize):
+        rows = slice(start, min(start + chunksize, len(times)))
+        if is_csv or not masks:
+            values = np.empty(rows.stop - start)
+            outlier_mask = np.empty(len(values), dtype=bool)
+            malfunction_mask = np.empty(len(values), dtype=bool)
+        if not is_csv:
+            # Render straight into the memory-mapped arrays:
+            values = writer.values[rows, 0]
+            if masks:
+                outlier_mask = writer.masks[rows, 0]
+                malfunction_mask = writer.masks[rows, 1]
+        plan.render_into(values, outlier_mask, malfunction_mask, times,
+                         location, rows, cache, clearsky_step)
 
-            slope = max_slope * rng.random(1)
+        if is_csv:
+            frame = pd.DataFrame({column: values})
+            if masks:
+                frame["outlier_mask"] = outlier_mask
+                frame["malfunction_mask"] = malfunction_mask
+            # Same layout as data/public: naive local timestamps.
+            frame.index = times[rows].tz_localize(None).rename("Timestamp")
+            frame.to_csv(output_path, mode="w" if start == 0 else "a",
+                         header=start == 0)
 
-            # Create linear drift series:
-            x = np.arange(index, index + fault_duration)
-            x = x[x < len(self.clearsky)]  # Prevent access to inexistent values
-            y = slope*(x - x0) + y0
+        summary["rows"] += len(values)
+        summary["outliers"] += int(outlier_mask.sum())
+        summary["malfunctions"] += int(malfunction_mask.sum())
 
-            # Update masks
-            self.malfunction_mask[x] = True
-            self.outlier_mask[x] = False
+    if writer is not None:
+        writer.close()
+    return summary
 
-            # Update series
-            self.series.iloc[x] = y
-        return self.series
 
 if __name__ == '__main__':
     # Test script:
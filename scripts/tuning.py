@@ -0,0 +1,183 @@
+""" Detector parameter tuning against synthetic ground truth.
+
+tune_parameters() renders seeded SyntheticPlan datasets, whose outlier and
+malfunction masks are exact, and scores every parameter set of a grid on
+them:
+
+    results = tune_parameters({"horizon": [60, 120], "tolerance": [0.5, 1],
+                               "day_margin": [1.25], "night_threshold": [10]})
+    print(results.head())
+
+Datasets are spread over a process pool. In each one the features that
+don't depend on the parameters are computed once: the night mask and the
+clearsky components (DetectionContext), and the rolling fit residuals of
+each horizon, which every tolerance reuses.
+"""
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pvlib
+
+if __name__ == "__main__":
+    from anomaly_detection import (DetectionContext, anomaly_clearsky,
+                                   anomaly_linear)
+    from linear_fit import rolling_linear_residual_std
+    from synthetic_data_generation import SyntheticPlan, default_location
+else:
+    from . anomaly_detection import (DetectionContext, anomaly_clearsky,
+                                     anomaly_linear)
+    from . linear_fit import rolling_linear_residual_std
+    from . synthetic_data_generation import SyntheticPlan, default_location
+
+
+DEFAULT_GRID = {"horizon": [30, 60, 120, 240],
+                "tolerance": [0.25, 0.5, 1, 2, 4],
+                "day_margin": [1.1, 1.25, 1.5],
+                "night_threshold": [5, 10, 20]}
+
+# Parameters of each detector, the others don't change its mask:
+CLEARSKY_PARAMETERS = ["day_margin", "night_threshold"]
+LINEAR_PARAMETERS = ["horizon", "tolerance"]
+
+
+def tune_parameters(grid: dict = None,
+                    num_datasets: int = 8,
+                    days: float = 30,
+                    seed: int = 0,
+                    location: pvlib.location.Location = None,
+                    irradiance_type: str = "ghi",
+                    min_irradiance: float = 10,
+                    clearsky_step: str = None,
+                    max_workers: int = None) -> pd.DataFrame:
+    """
+    Scores every combination of the grid on num_datasets synthetic datasets.
+
+    Each dataset is a SyntheticPlan with sensor disconnects, noise and
+    outliers, with its own seed and start date (spread over a year, so the
+    seasons are covered). The clearsky mask is scored against the outlier
+    mask, the linear mask against the malfunction mask, and their union
+    against the union of both.
+
+    Args:
+        grid: dict of parameter -> list of values, for the keys of
+            DEFAULT_GRID (missing keys take its values).
+        num_datasets: Number of synthetic datasets.
+        days: Days of minute data per dataset.
+        seed: Seed of the datasets.
+        location: pvlib.location.Location. Defaults to default_location().
+        irradiance_type, min_irradiance: As in the detectors.
+        clearsky_step: Optional coarse grid spacing of the clearsky model.
+        max_workers: Number of processes. Defaults to the number of cores.
+
+    Returns:
+        results: pandas.DataFrame with one row per parameter set, best F1
+            first: the parameters, tp, fp, fn, precision, recall and f1 of
+            the union, and the precision, recall and f1 of each detector
+            (clearsky_*, linear_*). Counts are summed over the datasets.
+    """
+    grid = {**DEFAULT_GRID, **(grid or {})}
+    location = location or default_location()
+    seeds = np.random.SeedSequence(seed).generate_state(num_datasets)
+    first_day = pd.Timestamp("2025-01-01")
+    tasks = [(int(dataset_seed),
+              first_day + pd.Timedelta(days=365 * number // num_datasets),
+              days, grid, location, irradiance_type, min_irradiance,
+              clearsky_step)
+             for number, dataset_seed in enumerate(seeds)]
+
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(tasks), 1))
+    if max_workers == 1:
+        counts = [_score_dataset(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            counts = list(executor.map(_score_dataset, *zip(*tasks)))
+    totals = {key: sum(count[key] for count in counts) for key in counts[0]}
+
+    # One row per (clearsky, linear) pair, the same order as the counts:
+    clearsky_sets = _combinations(grid, CLEARSKY_PARAMETERS)
+    linear_sets = _combinations(grid, LINEAR_PARAMETERS)
+    results = pd.DataFrame([{**clearsky, **linear}
+                            for clearsky in clearsky_sets
+                            for linear in linear_sets])
+    results = results[list(DEFAULT_GRID)]
+    for key in ["tp", "fp", "fn"]:
+        results[key] = totals[key].ravel().astype(np.int64)
+    _add_scores(results, results["tp"], results["fp"], results["fn"])
+    for detector, repeat, tile in [("clearsky", len(linear_sets), 1),
+                                   ("linear", 1, len(clearsky_sets))]:
+        tp, fp, fn = (np.tile(np.repeat(totals[f"{detector}_{key}"], repeat),
+                              tile) for key in ["tp", "fp", "fn"])
+        _add_scores(results, tp, fp, fn, prefix=f"{detector}_")
+    return (results.sort_values("f1", ascending=False, kind="stable")
+            .reset_index(drop=True))
+
+
+def _score_dataset(seed, start, days, grid, location, irradiance_type,
+                   min_irradiance, clearsky_step):
+    # Confusion counts of every parameter set on one synthetic dataset.
+    times = pd.date_range(start, periods=int(days * 1440), freq="min",
+                          tz=location.tz)
+    plan = SyntheticPlan(seed=seed, irradiance_type=irradiance_type)
+    plan = plan.sensor_disconnect().noise().outliers()
+    series, outlier_mask, malfunction_mask = plan.render(times, location)
+    is_anomaly = outlier_mask | malfunction_mask
+    context = DetectionContext(times, location, clearsky_step=clearsky_step)
+
+    clearsky_masks = np.array([
+        anomaly_clearsky(series, location, irradiance_type,
+                         params["day_margin"], params["night_threshold"],
+                         context=context)[0].to_numpy()
+        for params in _combinations(grid, CLEARSKY_PARAMETERS)])
+
+    linear_masks = []
+    for horizon in grid["horizon"]:
+        # The fit only depends on the horizon, not on the tolerance:
+        residual_std = rolling_linear_residual_std(series.values, horizon)
+        for tolerance in grid["tolerance"]:
+            linear_masks.append(anomaly_linear(
+                series, location, horizon, tolerance, min_irradiance,
+                context=context, residual_std=residual_std).to_numpy())
+    linear_masks = np.array(linear_masks)
+
+    counts = {}
+    for detector, masks, truth in [("clearsky", clearsky_masks, outlier_mask),
+                                   ("linear", linear_masks, malfunction_mask)]:
+        tp = (masks & truth).sum(axis=1)
+        counts[f"{detector}_tp"] = tp
+        counts[f"{detector}_fp"] = masks.sum(axis=1) - tp
+        counts[f"{detector}_fn"] = truth.sum() - tp
+
+    # Counts of the union of every pair, from the pairwise overlaps
+    # (|C or L| = |C| + |L| - |C and L|) computed as matrix products:
+    clearsky_float = clearsky_masks.astype(float)
+    linear_float = linear_masks.astype(float)
+    overlap = clearsky_float @ linear_float.T
+    overlap_tp = (clearsky_float * is_anomaly) @ linear_float.T
+    clearsky_hits = (clearsky_masks & is_anomaly).sum(axis=1)
+    linear_hits = (linear_masks & is_anomaly).sum(axis=1)
+    tp = clearsky_hits[:, np.newaxis] + linear_hits - overlap_tp
+    flagged = (clearsky_masks.sum(axis=1)[:, np.newaxis]
+               + linear_masks.sum(axis=1) - overlap)
+    counts["tp"] = tp
+    counts["fp"] = flagged - tp
+    counts["fn"] = is_anomaly.sum() - tp
+    return counts
+
+
+def _combinations(grid, names):
+    return [dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+
+def _add_scores(results, tp, fp, fn, prefix=""):
+    tp, fp, fn = (np.asarray(count, dtype=float) for count in (tp, fp, fn))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        f1 = np.where(precision + recall > 0,
+                      2 * precision * recall / (precision + recall), 0.0)
+    results[f"{prefix}precision"] = precision
+    results[f"{prefix}recall"] = recall
+    results[f"{prefix}f1"] = f1
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.anomaly_detection import (DetectionContext, anomaly_clearsky,
+                                       anomaly_linear, anomaly_stuck,
+                                       get_night_mask)
+from scripts.synthetic_data_generation import (SyntheticPlan, default_location,
+                                               default_times)
+
+
+def _series(seed=0):
+    # Two days of synthetic minute data with disconnects, noise, outliers
+    # and a few NaN gaps.
+    location = default_location()
+    times = default_times()[:2 * 1440]
+    plan = (SyntheticPlan(seed=seed).sensor_disconnect(num_events=2)
+            .noise().outliers())
+    series, _, _ = plan.render(times, location)
+    series.iloc[[700, 701, 702, 1500, 2100]] = np.nan
+    return series, location
+
+
+def _rolling_apply_linear(timeseries, location, horizon, tolerance,
+                          min_irradiance):
+    # anomaly_linear before its vectorization: np.polyfit on every window.
+    is_daytime = ~get_night_mask(timeseries.index, location)
+    is_relevant = (timeseries.values >= min_irradiance) & is_daytime
+
+    def linfit_score(series_sample) -> float:
+        t = np.arange(len(series_sample))
+        slope, intercept = np.polyfit(t, series_sample, 1)
+        return np.std(series_sample - (slope * t + intercept))
+
+    is_linear = timeseries.rolling(horizon).apply(linfit_score) <= tolerance
+    for k in range(horizon, len(is_linear)):
+        if is_linear.iloc[k]:
+            is_linear.iloc[k - horizon] = True
+    return is_linear & is_relevant
+
+
+@pytest.mark.parametrize("horizon", [5, 30, 120])
+def test_linear_matches_rolling_apply(horizon):
+    series, location = _series()
+    expected = _rolling_apply_linear(series, location, horizon, 1, 10)
+    mask = anomaly_linear(series, location, horizon, 1, 10)
+    assert expected.any()
+    assert np.array_equal(mask.to_numpy(), expected.to_numpy())
+    assert mask.index.equals(series.index)
+
+
+def test_dataframe_matches_per_column():
+    series, location = _series()
+    frame = pd.DataFrame({f"sensor_{seed}": _series(seed)[0].to_numpy()
+                          for seed in range(3)}, index=series.index)
+    context = DetectionContext(frame.index, location)
+
+    clearsky_masks, threshold = anomaly_clearsky(frame, location, "ghi",
+                                                 context=context)
+    linear_masks = anomaly_linear(frame, location, 30, context=context)
+    assert list(clearsky_masks.columns) == list(frame.columns)
+    assert list(linear_masks.columns) == list(frame.columns)
+    for column in frame:
+        clearsky_mask, column_threshold = anomaly_clearsky(frame[column],
+                                                           location, "ghi")
+        pd.testing.assert_series_equal(clearsky_masks[column], clearsky_mask)
+        pd.testing.assert_series_equal(threshold, column_threshold)
+        pd.testing.assert_series_equal(
+            linear_masks[column], anomaly_linear(frame[column], location, 30))
+
+
+def _naive_stuck(values, is_daytime, min_length, tolerance, zero_threshold):
+    # Scans the samples once, closing each frozen or dropout run.
+    mask = np.zeros(len(values), dtype=bool)
+    is_low = [is_daytime[k] and not values[k] > zero_threshold
+              for k in range(len(values))]
+    frozen_start = low_start = 0
+    for k in range(1, len(values) + 1):
+        continues_frozen = (k < len(values) and is_daytime[k]
+                            and is_daytime[k - 1]
+                            and abs(values[k] - values[k - 1]) <= tolerance)
+        if not continues_frozen:
+            if k - frozen_start >= min_length and is_daytime[frozen_start]:
+                mask[frozen_start:k] = True
+            frozen_start = k
+        if not (k < len(values) and is_low[k] and is_low[k - 1]):
+            if k - low_start >= min_length and is_low[low_start]:
+                mask[low_start:k] = True
+            low_start = k
+    return mask
+
+
+@pytest.mark.parametrize("min_length, tolerance", [(1, 0), (5, 0), (30, 0.5)])
+def test_stuck_matches_run_scan(min_length, tolerance):
+    series, location = _series()
+    values = series.to_numpy().copy()
+    values[600:660] = values[600]        # Frozen
+    values[900:940] = 0                  # Dropout
+    values[1000:1010] = np.nan           # Short NaN dropout
+    values[2040:2090] = values[2040] + 0.2 * (np.arange(50) % 2)  # Jitter
+    series = pd.Series(values, index=series.index)
+    is_daytime = ~get_night_mask(series.index, location)
+
+    mask = anomaly_stuck(series, location, min_length, tolerance)
+    expected = _naive_stuck(values, is_daytime, min_length, tolerance, 1)
+    assert expected.any()
+    assert np.array_equal(mask.to_numpy(), expected)
@@ -0,0 +1,28 @@
+import os
+
+import pandas as pd
+
+from scripts.batch_cleaning import run_batch
+from scripts.synthetic_data_generation import (default_location,
+                                               write_synthetic_dataset)
+
+
+def test_sites_share_one_ingest_per_file(tmp_path):
+    location = default_location()
+    times = pd.date_range("2025-03-01", periods=1440, freq="min",
+                          tz=location.tz)
+    path = str(tmp_path / "shared.csv")
+    write_synthetic_dataset(path, times, location, seed=0, masks=False)
+    sites = [{"name": f"site{number}", "path": path, "tz": location.tz,
+              "latitude": location.latitude,
+              "longitude": location.longitude}
+             for number in range(3)]
+    sites.append({**sites[0], "name": "utc", "tz": "UTC"})
+
+    for max_workers in [1, 2]:
+        output_dir = tmp_path / f"output{max_workers}"
+        summary = run_batch(sites, str(output_dir), max_workers=max_workers)
+        assert (summary["error"] == "").all()
+        assert (summary["rows"] == len(times)).all()
+        assert len(os.listdir(output_dir / "_sources")) == 2
+        assert not (output_dir / "site0" / "source").exists()
@@ -0,0 +1,21 @@
+import pandas as pd
+
+from scripts.chunked_cleaning import clean_csv_in_chunks
+from scripts.synthetic_data_generation import (default_location,
+                                               write_synthetic_dataset)
+
+
+def test_mask_columns_are_not_cleaned(tmp_path):
+    location = default_location()
+    times = pd.date_range("2025-03-01", periods=2 * 1440, freq="min",
+                          tz=location.tz)
+    path = tmp_path / "synthetic.csv"
+    write_synthetic_dataset(path, times, location, seed=0, masks=True)
+
+    output_path = tmp_path / "clean.csv"
+    summary = clean_csv_in_chunks(path, output_path, location, chunksize=500)
+    assert set(summary) == {"rows", "GHI_clearsky_outlier",
+                            "GHI_linear_anomaly"}
+    assert list(pd.read_csv(output_path, nrows=1).columns) == [
+        "Timestamp", "GHI", "GHI_clean", "GHI_clearsky_outlier",
+        "GHI_linear_anomaly"]
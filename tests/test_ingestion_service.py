@@ -0,0 +1,80 @@
+import asyncio
+import socket
+
+from scripts.ingestion_service import IngestionService
+
+
+LINES = [b"sensor0,1740830400000000000,512.5",
+         b"bad line",
+         b"sensor0,1740830460000000000,not a number",
+         b"sensor0,1740830520000000000,515.0"]
+
+
+async def _run_service(send):
+    service = IngestionService()
+    consumer = asyncio.ensure_future(service.run())
+    await send(service)
+    await asyncio.sleep(0.2)  # Let the sources queue what they received
+    await service.stop()
+    await consumer
+    return service.stats()
+
+
+def test_malformed_tcp_line_is_rejected():
+    async def send(service):
+        server = await service.start_tcp("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"\n".join(LINES) + b"\n")
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    stats = asyncio.run(_run_service(send))
+    assert stats["records"] == 2
+    assert stats["rejected"] == 2
+
+
+def test_malformed_udp_line_is_rejected():
+    async def send(service):
+        transport = await service.start_udp("127.0.0.1", 0)
+        port = transport.get_extra_info("sockname")[1]
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            sender.sendto(b"\n".join(LINES), ("127.0.0.1", port))
+
+    stats = asyncio.run(_run_service(send))
+    assert stats["records"] == 2
+    assert stats["rejected"] == 2
+
+
+def test_malformed_csv_row_is_rejected(tmp_path):
+    path = tmp_path / "sensor.csv"
+    path.write_text("Timestamp,GHI\n"
+                    "2025-03-01 12:00:00,510.0\n"
+                    "not a time,511.0\n"
+                    "2025-03-01 12:02:00,oops\n"
+                    "2025-03-01 12:03:00,513.0\n")
+
+    async def send(service):
+        service.tail_csv(str(path), "America/Santiago", poll_interval=0.05)
+
+    stats = asyncio.run(_run_service(send))
+    assert stats["records"] == 2
+    assert stats["rejected"] == 2
+
+
+def test_out_of_order_reading_is_not_a_record():
+    async def send(service):
+        server = await service.start_tcp("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"sensor0,1740830460000000000,512.5\n"
+                     b"sensor0,1740830400000000000,511.0\n"
+                     b"sensor0,1740830520000000000,515.0\n")
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    stats = asyncio.run(_run_service(send))
+    assert stats["records"] == 2
+    assert stats["rejected"] == 1
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.intervals import AnomalyIntervals
+from scripts.linear_fit import backfill_window
+
+
+def _random_masks(seed, length=500):
+    # Sparse runs, like real anomaly masks, and the edge samples set.
+    rng = np.random.default_rng(seed)
+    masks = []
+    for _ in range(2):
+        mask = np.zeros(length, dtype=bool)
+        for start in rng.integers(0, length, 20):
+            mask[start:start + rng.integers(1, 15)] = True
+        mask[[0, -1]] = rng.random(2) < 0.5
+        masks.append(mask)
+    return masks
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_set_algebra_matches_masks(seed):
+    a, b = _random_masks(seed)
+    intervals_a = AnomalyIntervals.from_mask(a)
+    intervals_b = AnomalyIntervals.from_mask(b)
+    assert np.array_equal(intervals_a.to_mask(), a)
+    assert np.array_equal((intervals_a | intervals_b).to_mask(), a | b)
+    assert np.array_equal((intervals_a & intervals_b).to_mask(), a & b)
+    assert np.array_equal((~intervals_a).to_mask(), ~a)
+    assert np.array_equal((intervals_a - intervals_b).to_mask(), a & ~b)
+    for horizon in [1, 7, 120]:
+        assert np.array_equal(intervals_a.backfill(horizon).to_mask(),
+                              backfill_window(a, horizon))
+
+
+def test_normalized_and_empty():
+    intervals = AnomalyIntervals([5, 0, 3, 9], [7, 3, 4, 9], 10)
+    assert intervals.starts.tolist() == [0, 5]
+    assert intervals.stops.tolist() == [4, 7]
+    assert AnomalyIntervals.from_mask(np.zeros(10, dtype=bool)) == \
+        ~AnomalyIntervals.from_mask(np.ones(10, dtype=bool))
+
+
+def test_overlapping_by_timestamp():
+    times = pd.date_range("2025-03-01", periods=60, freq="min",
+                          tz="America/Santiago")
+    mask = pd.Series(False, index=times)
+    mask.iloc[10:20] = True
+    mask.iloc[40:45] = True
+    intervals = AnomalyIntervals.from_mask(mask)
+    found = intervals.overlapping("2025-03-01 00:19", "2025-03-01 00:39")
+    assert found.starts.tolist() == [10]
+    assert found.to_frame()["first_time"].iloc[0] == times[10]
+    assert len(intervals.overlapping(20, 39)) == 0
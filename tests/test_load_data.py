@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pvlib
+
+from scripts.load_data import read_dataset_chunks
+from scripts.chunked_cleaning import clean_csv_in_chunks
+
+
+TZ = "America/Santiago"
+
+
+def _write_dst_end_csv(path):
+    # One day of minute data around the end of DST (2025-04-05 23:00 local
+    # repeated), as naive local timestamps.
+    times = pd.date_range("2025-04-05 12:00", periods=24 * 60, freq="min",
+                          tz="UTC").tz_convert(TZ)
+    frame = pd.DataFrame({"Timestamp": times.strftime("%Y-%m-%d %H:%M:%S"),
+                          "GHI": np.arange(len(times), dtype=float)})
+    frame.to_csv(path, index=False)
+    return times
+
+
+def test_read_chunks_across_dst_end(tmp_path):
+    path = tmp_path / "dst.csv"
+    times = _write_dst_end_csv(path)
+    for chunksize in [7, 100, 200, 10_000]:
+        data = pd.concat(read_dataset_chunks(path, TZ, chunksize))
+        assert data.index.equals(times)
+
+
+def test_clean_csv_across_dst_end(tmp_path):
+    path = tmp_path / "dst.csv"
+    _write_dst_end_csv(path)
+    location = pvlib.location.Location(-41.13941227780086, -73.02542294598776,
+                                       tz=TZ)
+    # 100 and 200 rows split the repeated hour between two chunks:
+    outputs = {}
+    for chunksize in [100, 200, 10_000]:
+        output_path = tmp_path / f"clean_{chunksize}.csv"
+        summary = clean_csv_in_chunks(path, output_path, location,
+                                      chunksize=chunksize)
+        assert summary["rows"] == 24 * 60
+        outputs[chunksize] = output_path.read_text()
+    assert outputs[100] == outputs[10_000]
+    assert outputs[200] == outputs[10_000]
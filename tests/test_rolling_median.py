@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from scripts.rolling_median import rolling_median_mad
+
+
+@pytest.mark.parametrize("window", [1, 2, 3, 4, 15, 16, 61, 240])
+def test_partition_matches_nanmedian(window):
+    # NaN samples and gaps (windows of every valid count, and none) and
+    # repeated values.
+    rng = np.random.default_rng(0)
+    values = rng.normal(500, 100, 3000)
+    values[rng.integers(0, len(values), 60)] = np.nan
+    values[1000:1300] = np.nan
+    values[2000:2100] = 3.0
+    values[::7] = np.round(values[::7], -2)
+
+    median, mad = rolling_median_mad(values, window)
+    expected_median, expected_mad = rolling_median_mad(values, window,
+                                                       "strided")
+    assert np.array_equal(median, expected_median, equal_nan=True)
+    assert np.array_equal(mad, expected_mad, equal_nan=True)
+    assert np.isnan(median[:window - 1]).all()
@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import numpy as np
+import pandas as pd
+
+from scripts.solar_cache import SolarCache
+from scripts.synthetic_data_generation import default_location
+
+
+def _times():
+    return pd.date_range("2025-03-01", periods=1440, freq="min",
+                         tz="America/Santiago")
+
+
+def test_computed_array_survives_eviction(tmp_path, monkeypatch):
+    cache = SolarCache(str(tmp_path))
+    # Another process evicting the entry right after it was stored:
+    monkeypatch.setattr(cache.store, "evict", cache.store.clear)
+    values = cache.get_array("test", default_location(), _times(),
+                             lambda: np.arange(1440.0))
+    assert np.array_equal(values, np.arange(1440.0))
+    assert not values.flags.writeable
+
+
+def test_threads_share_an_entry(tmp_path):
+    cache = SolarCache(str(tmp_path))
+    location, times = default_location(), _times()
+
+    def get(_):
+        return cache.get_array("test", location, times,
+                               lambda: np.arange(1440.0))
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(get, range(64)))
+    assert all(np.array_equal(values, np.arange(1440.0))
+               for values in results)
+    assert os.listdir(tmp_path) == [cache.key("test", location, times)
+                                    + ".npy"]
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from scripts.synthetic_data_generation import (SyntheticIrradiance,
+                                               SyntheticPlan, default_location)
+
+
+def test_render_window_matches_full_render():
+    # Small blocks, so the windows start and end inside random blocks.
+    location = default_location()
+    times = pd.date_range("2025-03-01", periods=7 * 1440, freq="min",
+                          tz=location.tz)
+    plan = (SyntheticPlan(seed=3, block_size=1000).sensor_disconnect()
+            .noise().outliers())
+    series, outlier_mask, malfunction_mask = plan.render(times, location)
+    assert outlier_mask.any() and malfunction_mask.any()
+
+    for start, end in [(0, 99), (1234, 5678), (2500, len(times) - 1)]:
+        window, window_outliers, window_malfunctions = plan.render(
+            times, location, times[start], times[end])
+        pd.testing.assert_series_equal(window, series.iloc[start:end + 1])
+        assert np.array_equal(window_outliers, outlier_mask[start:end + 1])
+        assert np.array_equal(window_malfunctions,
+                              malfunction_mask[start:end + 1])
+
+
+def test_add_methods_return_a_snapshot():
+    ghi = SyntheticIrradiance(seed=0)
+    noisy = ghi.add_noise()
+    before = noisy.copy()
+    with_outliers = ghi.add_outliers()
+    ghi.add_sensor_disconnect()
+    pd.testing.assert_series_equal(noisy, before)
+    assert not with_outliers.equals(ghi.series)
+    assert not noisy.equals(with_outliers)